@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Admission parsing benchmark
+
+Parses a full update cycle of specialty pages (SPbU layout) inside the event loop and in a process pool,
+while a heartbeat task measures how late the event loop wakes it up (the lag the gateway heartbeat would see).
+Both ways must give identical tables.
+
+Usage:
+    python benchmarks/admission_parse.py [page.html ...] [--specialties N] [--rows N] [--workers N]
+
+Without pages synthetic ones are used (save real specialty pages with "curl -o page.html <link>").
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.applicants import parse_spbu_applicants  # noqa: E402
+
+
+def synthetic_page(rows: int, seed: int):
+    """Returns specialty page with the table of applicants"""
+    random.seed(seed)
+    conditions = ['Без ВИ', 'По результатам ВИ']
+    parts = ['<html><body><h1>Список поступающих</h1><table><thead><tr>' + '<th>x</th>' * 13 + '</tr></thead><tbody>']
+    for number in range(1, rows + 1):
+        tds = [
+            str(number), f'{random.randrange(10 ** 11):011d}', random.choice(conditions), str(random.randint(1, 5)),
+            str(random.randint(150, 300)), str(random.randint(150, 300)), str(random.randint(40, 100)),
+            str(random.randint(40, 100)), str(random.randint(40, 100)), str(random.randint(0, 10)),
+            random.choice(['Да', 'Нет']), '', random.choice(['', 'Целевое'])
+        ]
+        parts.append('<tr>' + ''.join(f'<td>{td}</td>' for td in tds) + '</tr>')
+    parts.append('</tbody></table></body></html>')
+    return ''.join(parts)
+
+
+async def heartbeat(lags: list, interval: float = 0.01):
+    """Records how late each wake-up is"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def cycle(pages: list, pool: ProcessPoolExecutor = None):
+    """Parses all pages, returns (tables, seconds, lags)"""
+    lags = []
+    monitor = asyncio.ensure_future(heartbeat(lags))
+    await asyncio.sleep(0.05)
+    loop = asyncio.get_event_loop()
+
+    start = time.perf_counter()
+    if pool is None:  # Parse in the event loop as each page arrives
+        tables = []
+        for html in pages:
+            tables.append(parse_spbu_applicants(html))
+            await asyncio.sleep(0)
+    else:
+        tables = await asyncio.gather(*(loop.run_in_executor(pool, parse_spbu_applicants, html) for html in pages))
+    duration = time.perf_counter() - start
+
+    await asyncio.sleep(0.05)
+    monitor.cancel()
+    return tables, duration, lags
+
+
+def report(name: str, duration: float, lags: list):
+    lags = sorted(lags)
+    p99 = lags[min(len(lags) - 1, int(0.99 * len(lags)))]
+    print(
+        f"{name:>8}: cycle {duration:6.2f}s, loop lag max {lags[-1] * 1000:7.1f} ms, "
+        f"p99 {p99 * 1000:7.1f} ms, mean {statistics.mean(lags) * 1000:6.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', help="Saved specialty pages")
+    parser.add_argument('--specialties', type=int, default=20, help="Synthetic pages in the cycle")
+    parser.add_argument('--rows', type=int, default=2000, help="Applicants on a synthetic page")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes (ADMISSION_PARSE_WORKERS)")
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, encoding='utf-8') as file:
+                pages.append(file.read())
+    else:
+        pages = [synthetic_page(args.rows, seed) for seed in range(args.specialties)]
+    print(f"{len(pages)} pages, {sum(map(len, pages)) / 2 ** 20:.1f} MiB of HTML, {args.workers} workers")
+
+    loop = asyncio.get_event_loop()
+    inline_tables, duration, lags = loop.run_until_complete(cycle(pages))
+    report('inline', duration, lags)
+
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        loop.run_until_complete(cycle(pages[:1], pool))  # Start workers
+        pool_tables, duration, lags = loop.run_until_complete(cycle(pages, pool))
+    report('pool', duration, lags)
+
+    print("Identical tables:", inline_tables == list(pool_tables))
+
+
+if __name__ == '__main__':
+    main()
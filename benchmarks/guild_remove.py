@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Guild remove benchmark
+
+Compares the old on_guild_remove algorithm (member tuple + Python membership tests)
+with the set-based DataEvents.GUILD_REMOVE statement on a synthetic guild
+and checks that both leave the same users.
+
+Usage:
+    DATABASE_URL=postgres://... python benchmarks/guild_remove.py [--members N] [--shared FRACTION]
+
+Only temporary tables are used (they shadow the bot tables within the session), but use a scratch database anyway.
+The old algorithm is quadratic, with 50k members it takes minutes.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psycopg2.extras import execute_values  # noqa: E402
+from cogs.data_events import DataEvents  # noqa: E402
+from utils.database import connect  # noqa: E402
+
+GUILD_ID, OTHER_GUILD_ID = 1, 2
+
+
+def prepare(cursor, members: int, shared: float):
+    """Creates temporary tables with the removed guild and another guild sharing some of its users"""
+    cursor.execute("DROP TABLE IF EXISTS pg_temp.ds_member, pg_temp.ds_user, pg_temp.ds_guild;")
+    cursor.execute("CREATE TEMP TABLE ds_guild (guild_id BIGINT PRIMARY KEY, guild_name TEXT);")
+    cursor.execute("CREATE TEMP TABLE ds_user (user_id BIGINT PRIMARY KEY, user_name TEXT);")
+    cursor.execute(
+        "CREATE TEMP TABLE ds_member ("
+        "user_id BIGINT REFERENCES ds_user ON DELETE CASCADE, "
+        "guild_id BIGINT REFERENCES ds_guild ON DELETE CASCADE, "
+        "is_owner BOOLEAN, "
+        "PRIMARY KEY (user_id, guild_id));"
+    )
+    others = members // 2
+    execute_values(cursor, "INSERT INTO ds_guild VALUES %s;", [(GUILD_ID, 'removed'), (OTHER_GUILD_ID, 'other')])
+    execute_values(cursor, "INSERT INTO ds_user VALUES %s;", [(i, f'user{i}') for i in range(members + others)])
+    execute_values(cursor, "INSERT INTO ds_member VALUES %s;", [(i, GUILD_ID, i == 0) for i in range(members)])
+    execute_values(
+        cursor, "INSERT INTO ds_member VALUES %s;",
+        [(i, OTHER_GUILD_ID, False) for i in range(members - int(members * shared), members + others)]
+    )
+    cursor.execute("ANALYZE ds_guild, ds_user, ds_member;")
+
+
+def old_remove(cursor):
+    """on_guild_remove before the set-based statement, returns the number of round trips"""
+    cursor.execute("SELECT user_id FROM ds_member WHERE guild_id=%s;", (GUILD_ID, ))
+    guild_members = tuple(user_id[0] for user_id in cursor.fetchall())
+    cursor.execute("DELETE FROM ds_guild WHERE guild_id=%s;", (GUILD_ID, ))
+    cursor.execute("SELECT user_id FROM ds_member WHERE user_id IN %s;", (guild_members, ))
+    another_guild_members = tuple(user_id[0] for user_id in cursor.fetchall())
+    deleted_users = tuple(member for member in guild_members if member not in another_guild_members)
+    cursor.execute("DELETE FROM ds_user WHERE user_id IN %s;", (deleted_users, ))
+    return 4
+
+
+def new_remove(cursor):
+    """Set-based on_guild_remove, returns the number of round trips"""
+    cursor.execute(DataEvents.GUILD_REMOVE, {'guild_id': GUILD_ID})
+    return 1
+
+
+def run(connection, remove, members: int, shared: float):
+    """Returns (seconds, round trips, remaining user IDs)"""
+    with connection.cursor() as cursor:
+        prepare(cursor, members, shared)
+        connection.commit()
+        start = time.perf_counter()
+        round_trips = remove(cursor)
+        connection.commit()
+        duration = time.perf_counter() - start
+        cursor.execute("SELECT user_id FROM ds_user ORDER BY user_id;")
+        return duration, round_trips, [row[0] for row in cursor.fetchall()]
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arguments.add_argument('--members', type=int, default=50000, help="Members of the removed guild")
+    arguments.add_argument('--shared', type=float, default=0.3, help="Part of them that are in another guild too")
+    args = arguments.parse_args()
+
+    connection = connect()
+    try:
+        new_time, new_trips, new_users = run(connection, new_remove, args.members, args.shared)
+        old_time, old_trips, old_users = run(connection, old_remove, args.members, args.shared)
+    finally:
+        connection.close()
+
+    print(f"Guild with {args.members} members, {args.shared:.0%} of them shared with another guild")
+    print(f"{'version':<10}{'time, s':>10}{'round trips':>14}")
+    print(f"{'old':<10}{old_time:>10.3f}{old_trips:>14}")
+    print(f"{'set-based':<10}{new_time:>10.3f}{new_trips:>14}")
+    print(f"Remaining users: {len(new_users)}, identical: {old_users == new_users}")
+    return 0 if old_users == new_users else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Schedule page parsers benchmark
+
+Compares parse_schedule (BeautifulSoup tree) with parse_schedule_stream (lxml iterparse):
+checks that both give identical output and measures parse time and peak memory of Python objects.
+
+Usage:
+    python benchmarks/schedule_parser.py [page.html] [--repeat N]
+
+Without a page a synthetic one with the same layout as the school website is used
+(save a real page with "curl -o page.html <ScheduleURL>" to benchmark on it).
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.schedule import parse_schedule, parse_schedule_stream  # noqa: E402
+
+
+def synthetic_page(days: int = 6, courses: int = 24, lessons: int = 8, seed: int = 36):
+    """Returns page with schedules for several days surrounded by news and menus"""
+    random.seed(seed)
+    subjects = ['алгебра', 'геометрия', 'физика', 'химия', 'история', 'русский язык', 'литература', 'английский язык']
+    filler = '<div class="news"><p>' + 'Новости школы. ' * 40 + '</p><!-- news --></div>'
+    parts = ['<html><head><meta charset="utf-8"><title>Изменения в расписании</title></head><body>']
+    parts += ['<ul class="menu">' + '<li><a href="#">Раздел</a></li>' * 50 + '</ul>'] + [filler] * 20
+    for day in range(1, days + 1):
+        parts.append(f'<h2>Расписание на {day} сентября</h2>')
+        for half in range(2):
+            names = [f'{5 + (half * courses // 2 + n) // 4}{"абвг"[n % 4]}' for n in range(courses // 2)]
+            rows = ['<tr><td>\xa0</td>' + ''.join(f'<td><b>{name}</b></td>' for name in names) + '</tr>']
+            for lesson in range(1, lessons + 1):
+                cells, n = [], 0
+                while n < len(names):
+                    span = 2 if random.random() < 0.1 and n + 1 < len(names) else 1
+                    colspan = f' colspan="{span}"' if span > 1 else ''
+                    cells.append(f'<td{colspan}>\n{random.choice(subjects + [chr(160)])}\n</td>')
+                    n += span
+                rows.append(f'<tr><td>{lesson}</td>' + ''.join(cells) + '</tr>')
+            parts.append('<table><tbody>\n' + '\n'.join(rows) + '\n</tbody></table>')
+            parts.append('<table><tbody><tr><td> </td></tr></tbody></table>')  # Empty layout table
+        parts += [filler] * 5
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def measure(parser, html: str, repeat: int):
+    """Returns (result, best time in seconds, peak memory in bytes)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = parser(html)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    parser(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arguments.add_argument('page', nargs='?', help="Saved schedule page (synthetic page by default)")
+    arguments.add_argument('--repeat', type=int, default=20, help="Number of timed runs of each parser")
+    args = arguments.parse_args()
+
+    if args.page:
+        with open(args.page, encoding='utf-8', errors='replace') as file:
+            html = file.read()
+    else:
+        html = synthetic_page()
+    print(f"Page: {args.page or 'synthetic'} ({len(html.encode('utf-8')) / 1024:.0f} KiB)")
+
+    tree, tree_time, tree_peak = measure(parse_schedule, html, args.repeat)
+    stream, stream_time, stream_peak = measure(parse_schedule_stream, html, args.repeat)
+
+    print(f"{'parser':<8}{'time, ms':>12}{'peak, KiB':>12}")
+    print(f"{'tree':<8}{tree_time * 1000:>12.2f}{tree_peak / 1024:>12.0f}")
+    print(f"{'stream':<8}{stream_time * 1000:>12.2f}{stream_peak / 1024:>12.0f}")
+    print(f"Dates: {len(stream)}, identical output: {tree == stream}")
+    return 0 if tree == stream else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
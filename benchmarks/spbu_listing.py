@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""SPbU page of lists benchmark
+
+Compares the old index of the specialties (list(x.next_elements)[n], copies the rest of the document for every entry)
+with parse_spbu_specialties (bounded lookahead): checks that both find the same full-time specialties
+and measures index time for growing pages.
+
+Usage:
+    python benchmarks/spbu_listing.py [page.html] [--sizes N [N ...]]
+
+Without a page synthetic ones with the same element layout are used
+(save the real page with "curl -o page.html $SPBU_MAIN_LISTS_URL" to benchmark on it).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from utils.applicants import parse_spbu_specialties  # noqa: E402
+
+MAIN_URL = 'https://example.org'
+
+
+def parse_spbu_specialties_old(html: str, main_url: str):
+    """Index of the specialties as it was done in Admission.get_spbu_lists"""
+    soup = BeautifulSoup(html, 'lxml')
+    table_of_specialties = []
+    for h3 in soup.find_all('h3'):
+        specialty = h3.next_element
+        profile = list(specialty.next_elements)[2]
+        is_full_time = True if list(profile.next_elements)[2].get_text() == "Форма обучения: очная" else False
+        link = list(profile.next_elements)[6]
+        list_link = main_url + link.attrs['href'] if link.get_text() == "Госбюджетная" else None
+        if is_full_time:
+            table_of_specialties.append((str(specialty[:8]), str(specialty + ' ' + profile), list_link))
+    return table_of_specialties
+
+
+def synthetic_page(entries: int):
+    """Returns page of lists with the entries of specialties"""
+    forms = ['очная', 'очная', 'очно-заочная', 'заочная']
+    parts = ['<html><body><h1>Списки поступающих</h1>']
+    for number in range(entries):
+        code = f'{number % 50 + 1:02d}.03.{number % 7 + 1:02d}'
+        kind = 'Госбюджетная' if number % 3 else 'Договорная'
+        parts.append(
+            f'<h3>{code} Направление {number}</h3><p><b>Профиль {number}</b></p>'
+            f'<div><p>Форма обучения: {forms[number % len(forms)]}</p></div>'
+            f'<div><ul><li><a href="/list/{number}/budget">{kind}</a></li>'
+            f'<li><a href="/list/{number}/paid">Договорная</a></li></ul></div>'
+        )
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def best_time(function, html: str, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(html, MAIN_URL)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def compare(name: str, html: str, repeat: int):
+    old, old_time = best_time(parse_spbu_specialties_old, html, repeat)
+    new, new_time = best_time(parse_spbu_specialties, html, repeat)
+    new = [(code, specialty, link) for code, specialty, form, link in new if form == "очная"]
+    print(
+        f"{name:>12}: {len(old):5} full-time, old {old_time * 1000:9.1f} ms, new {new_time * 1000:7.1f} ms, "
+        f"identical: {old == new}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('page', nargs='?', help="Saved page of lists")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 400, 800], help="Synthetic entries")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page, encoding='utf-8') as file:
+            compare(os.path.basename(args.page), file.read(), args.repeat)
+    else:
+        for size in args.sizes:
+            compare(f"{size} entries", synthetic_page(size), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,11 @@
 import discord
 from discord.ext import commands
 import os
+from utils.database import Database
+from utils.guild_config import GuildConfig
+from utils.http import HttpClient
+from utils.migrations import migrate
+from utils.profiler import trigger
 
 
 class HelpCommand(commands.HelpCommand):
@@ -77,17 +82,43 @@ class HelpCommand(commands.HelpCommand):
         await self.get_destination().send(embed=embed)
 
 
+class Bot(commands.Bot):
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        """Runs the event handler with the event as the trigger of its database statements
+
+        Each handler runs in its own task, so the trigger is seen by the handler and the tasks it creates only.
+        """
+        trigger.set(f"event:{event_name}")
+        await super()._run_event(coro, event_name, *args, **kwargs)
+
+    async def close(self):
+        """Closes shared resources and lets cogs finish their work before the connection to Discord is closed"""
+        for cog in list(self.cogs.values()):
+            if hasattr(cog, 'close'):
+                await cog.close()
+        await self.web.close()
+        self.guild_config.close()
+        await self.db.close()
+        await super().close()
+
+
 token = os.environ['TOKEN']
 prefix = os.environ['COMMAND_PREFIX']
 intents = discord.Intents.default()
 intents.members = True
 
-bot = commands.Bot(command_prefix=prefix, help_command=HelpCommand(), case_insensitive=True, intents=intents)
+bot = Bot(command_prefix=prefix, help_command=HelpCommand(), case_insensitive=True, intents=intents)
 
 bot.ColorDefault = int(os.environ['COLOR_DEFAULT'], base=16)
 bot.ColorError = int(os.environ['COLOR_ERROR'], base=16)
 bot.BannedGuildInvite = os.environ['BANNED_GUILD_INVITE']
 bot.ScheduleURL = "http://school36.murmansk.su/izmeneniya-v-raspisanii/"
+bot.web = HttpClient()
+bot.db = Database(maxconn=int(os.environ.get('DATABASE_POOL_SIZE', 8)))
+bot.db.run_blocking(migrate, bot.ScheduleURL)  # Schema first: the settings cache and the extensions read it
+bot.guild_config = GuildConfig(bot.db, bot.loop)
+bot.guild_config.load_blocking()
+bot.guild_config.listen()
 
 
 @bot.event
@@ -96,6 +127,12 @@ async def on_ready():
     print(f"{bot.user.name}(ID:{bot.user.id}) online with prefix: {prefix}")
 
 
+@bot.before_invoke
+async def before_invoke(ctx):
+    """Marks the database statements of the command with its name"""
+    trigger.set(f"command:{ctx.command.qualified_name}")
+
+
 @bot.event
 async def on_command_error(ctx, error):
     """Sends an error message to the context channel"""
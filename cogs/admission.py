@@ -1,23 +1,28 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import discord
+import json
 from discord.ext import commands, tasks
+import multiprocessing
 import os
-import requests
-import bs4
-from bs4 import BeautifulSoup
 from re import fullmatch
 import gspread
 from gspread.utils import rowcol_to_a1
 import psycopg2
-from urllib.parse import urlparse
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 from datetime import datetime, timedelta, timezone
+import time
+import traceback
+from utils.applicants import (
+    parse_spbetu_applicants, parse_spbetu_specialties, parse_spbu_applicants, parse_spbu_specialties
+)
+from utils.browser import Browser
+from utils.profiler import trigger
 
 
 class Admission(commands.Cog, name="admission"):
@@ -40,142 +45,122 @@ class Admission(commands.Cog, name="admission"):
         }
         service_account = gspread.service_account_from_dict(credentials)
         self.spreadsheet = service_account.open("Поступление СПб")
+        self.worksheets = None  # {title: worksheet}, read on the first upload
 
-        # Postgres connection
-        result = urlparse(os.environ['DATABASE_URL'])
-        with psycopg2.connect(
-                dbname=result.path[1:],
-                user=result.username,
-                password=result.password,
-                host=result.hostname,
-                port=result.port
-        ) as connection:
-            connection.autocommit = True
-            self.cursor = connection.cursor()
+        # Sheets requests are blocking, they are sent one at a time from a dedicated thread
+        self.sheets_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets')
+        self.sheets_retries = int(os.environ.get('SHEETS_RETRIES', 5))
+        self.sheets_backoff = float(os.environ.get('SHEETS_BACKOFF', 2))  # Seconds before the first retry
 
-    @staticmethod
-    async def get_spbu_lists(specialties):
-        """Returns lists of applicants grouped by specialties
+        # Worker processes for HTML parsing (forked: bot.py starts the bot on import, spawned workers would run it)
+        self.parse_workers = int(os.environ.get('ADMISSION_PARSE_WORKERS', 2))
+        self.parse_pool = self.start_parse_pool()
 
-        :param specialties: list of strings - list of specialty codes
-        :return: dict - {specialty: [[row], [row]]}
-        """
-        # Get soup
-        response = requests.get(os.environ['SPBU_MAIN_LISTS_URL'])
-        response.encoding = 'utf-8'
-        soup = BeautifulSoup(response.text, 'lxml')
+        # Headless browser for the pages rendered by scripts (started on first use, kept between cycles)
+        self.browser = Browser()
 
-        # Get table of specialties
-        table_of_specialties = []
-        h3_list = soup.find_all('h3')
-        for h3 in h3_list:
-            specialty = h3.next_element
-            profile = list(specialty.next_elements)[2]
-            is_full_time = True if list(profile.next_elements)[2].get_text() == "Форма обучения: очная" else False
-            link = list(profile.next_elements)[6]
-            list_link = os.environ['SPBU_MAIN_URL'] + link.attrs['href'] if link.get_text() == "Госбюджетная" else None
-            if is_full_time:
-                code = specialty[:8]
-                specialty = specialty + ' ' + profile
-                table_of_specialties.append([code, specialty, list_link])
+        # Timings of the last update cycle: {university: {duration, error, specialties: {specialty: seconds}, upload}}
+        self.scrape_stats = {}
 
-        # Get tables of applicants by specialty
-        applicants_tables = {}
-        types_of_conditions = {
-            'Без ВИ': 'БВИ',
-            'По результатам ВИ': 'ОК'
-        }
-        for row in table_of_specialties:
-            code, specialty, applicants_table_link = row
+    def start_parse_pool(self):
+        """Returns the pool of parser processes with all workers already forked
 
-            if applicants_table_link is None:
-                continue
-            if code not in specialties:
-                continue
+        Workers are forked at once while the cog is loaded, before the database, browser and Sheets threads exist:
+        a process forked while other threads hold locks can deadlock on them.
+        """
+        pool = ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context('fork'))
+        pool.submit(os.getpid)  # The first task forks all workers
+        return pool
 
-            response = requests.get(applicants_table_link)
-            response.encoding = 'utf-8'
-            soup = BeautifulSoup(response.text, 'lxml')
+    async def parse(self, function, *args):
+        """Runs the parser in a worker process and returns its result
 
-            table_body = soup.tbody
-            applicants = []
-            for tr in table_body.find_all('tr'):
-                tds = [td.get_text() for td in tr.find_all('td')]
-                exams = [x.strip().replace(',', '.') if x.strip() else '0' for x in tds[4:6] + [tds[9]] + tds[6:9]]
-                conditions = types_of_conditions[tds[2]]
-                applicants.append(tds[:2] + [tds[3]] + [conditions] + exams + [tds[10]] + ['-'] + tds[11:13])
+        :param function: function - Parser from utils.applicants
+        """
+        try:
+            return await self.bot.loop.run_in_executor(self.parse_pool, function, *args)
+        except BrokenProcessPool:  # A worker has died, start new ones and try once more (the only fork at runtime)
+            self.parse_pool.shutdown(wait=False)
+            self.parse_pool = self.start_parse_pool()
+            return await self.bot.loop.run_in_executor(self.parse_pool, function, *args)
+
+    async def fetch_lists(self, links: dict, parse, encoding: str = None, timings: dict = None):
+        """Fetches the pages of applicants concurrently and parses each page in a worker process as soon as it arrives
+
+        A page that fails is skipped, the rest of the pages are still parsed.
+
+        :param links: dict - {specialty: applicants table link}
+        :param parse: function - Returns the list of applicants from the page HTML (from utils.applicants)
+        :param encoding: str - Page encoding (None to take it from the response)
+        :param timings: dict - Filled as {specialty: seconds of fetch and parse}
+        :return: dict - {specialty: [(row), (row)]} in the order of links
+        """
+        async def fetch(specialty, link):
+            start = time.perf_counter()
+            try:
+                response = await self.bot.web.get(link)
+                return specialty, await self.parse(parse, response.text(encoding)), start, None
+            except Exception as error:
+                return specialty, None, start, error
 
-            applicants_tables[specialty] = applicants
+        applicants_tables = {}
+        for future in asyncio.as_completed([fetch(specialty, link) for specialty, link in links.items()]):
+            specialty, applicants, start, error = await future
+            if error is None:
+                applicants_tables[specialty] = applicants
+            else:
+                print(f"Failed to get the applicants of {specialty}: {error!r}")
+            if timings is not None:
+                timings[specialty] = time.perf_counter() - start
 
-        return applicants_tables
+        return {specialty: applicants_tables[specialty] for specialty in links if specialty in applicants_tables}
 
-    @staticmethod
-    async def get_spbetu_lists(specialties):
+    async def get_spbu_lists(self, specialties, timings: dict = None):
         """Returns lists of applicants grouped by specialties
 
         :param specialties: list of strings - list of specialty codes
-        :return: dict - {specialty: [[row], [row]]}
+        :param timings: dict - Filled as {specialty: seconds}
+        :return: dict - {specialty: [(row), (row)]}
         """
-        # Get soup
-        response = requests.get(os.environ['ETU_MAIN_LISTS_URL'])
-        soup = BeautifulSoup(response.text, 'lxml')
-
         # Get table of specialties
-        table_of_specialties = []
-        table_body = soup.find(class_='table table-bordered').tbody
-        for td in table_body:
-            if not isinstance(td, bs4.element.Tag):
-                continue
-
-            row = td.find_all('td')
-
-            code = row[0].get_text()
-            specialty = row[1].get_text().replace('\t', '').replace('\r', '').replace('\n', '')
-            try:
-                applicants_table_link = os.environ['ETU_MAIN_URL'] + row[2].contents[0].attrs['href']
-            except AttributeError:
-                applicants_table_link = 'N/A'
-
-            table_of_specialties.append([code, specialty, applicants_table_link])
+        response = await self.bot.web.get(os.environ['SPBU_MAIN_LISTS_URL'])
+        table_of_specialties = await self.parse(
+            parse_spbu_specialties, response.text('utf-8'), os.environ['SPBU_MAIN_URL']
+        )
 
         # Get tables of applicants by specialty
-        applicants_tables = {}
-        for row in table_of_specialties:
-            code, specialty, applicants_table_link = row
-
-            if code not in specialties:
-                continue
+        links = {
+            specialty: link for code, specialty, form, link in table_of_specialties
+            if form == "очная" and link is not None and code in specialties
+        }
+        return await self.fetch_lists(links, parse_spbu_applicants, 'utf-8', timings)
 
-            response = requests.get(applicants_table_link)
-            soup = BeautifulSoup(response.text, 'lxml')
+    async def get_spbetu_lists(self, specialties, timings: dict = None):
+        """Returns lists of applicants grouped by specialties
 
-            table_body = soup.tbody
-            applicants = []
-            for tr in table_body.find_all('tr'):
-                tds = [td.get_text().replace('\n', '') for td in tr.find_all('td')]
-                applicants.append(tds[:6] + [tds[9]] + tds[6:9] + [tds[12]] + [tds[10]] + ['-', '-'])
-            specialty = code + ' ' + specialty
-            applicants_tables[specialty] = applicants
+        :param specialties: list of strings - list of specialty codes
+        :param timings: dict - Filled as {specialty: seconds}
+        :return: dict - {specialty: [(row), (row)]}
+        """
+        # Get table of specialties
+        response = await self.bot.web.get(os.environ['ETU_MAIN_LISTS_URL'])
+        table_of_specialties = await self.parse(parse_spbetu_specialties, response.text(), os.environ['ETU_MAIN_URL'])
 
-        return applicants_tables
+        # Get tables of applicants by specialty
+        links = {
+            code + ' ' + specialty: link for code, specialty, link in table_of_specialties if code in specialties
+        }
+        return await self.fetch_lists(links, parse_spbetu_applicants, None, timings)
 
     @staticmethod
-    async def get_itmo_lists(specialties):
-        """Returns lists of applicants grouped by specialties
+    def get_itmo_lists(driver, specialties, timings: dict = None):
+        """Returns lists of applicants grouped by specialties (blocking, runs in the browser thread)
 
+        :param driver: selenium.webdriver.Chrome - Running browser
         :param specialties: list of strings - list of specialty codes
+        :param timings: dict - Filled as {specialty: seconds}
         :return: dict - {specialty: [[row], [row]]}
         """
-        # Starting web driver
-        options = webdriver.ChromeOptions()
-        options.binary_location = os.environ['GOOGLE_CHROME_BIN']
-        options.add_argument("window-size=1920x1080")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--headless")
-
-        driver = webdriver.Chrome(service=Service(os.environ['CHROMEDRIVER_PATH']), options=options)
-
         # Get links for tables of applicants using selenium web driver
         driver.get(os.environ['ITMO_MAIN_URL'])
         driver.find_element(By.ID, 'tabs-tab-1').click()
@@ -185,7 +170,20 @@ class Admission(commands.Cog, name="admission"):
         # Get tables of applicants data
         applicants_tables = {}
         for link in links:
+            start = time.perf_counter()
             driver.get(link)
+
+            # Get specialty name with code (the heading is rendered empty first and filled in by scripts,
+            # untracked specialties are skipped without waiting for the table)
+            try:
+                specialty = WebDriverWait(driver, 10, ignored_exceptions=(StaleElementReferenceException, )).until(
+                    lambda x: x.find_element(By.XPATH, '//*[@id="__next"]/div/main/div[2]/div/div/div/h2').text.strip()
+                ).lower()
+            except TimeoutException:
+                continue
+            if specialty.split()[0] not in specialties:
+                continue
+
             # Get all rows
             try:
                 table = WebDriverWait(driver, 10).until(
@@ -194,11 +192,6 @@ class Admission(commands.Cog, name="admission"):
             except TimeoutException:
                 continue
 
-            # Get specialty name with code
-            specialty = driver.find_element(By.XPATH, '//*[@id="__next"]/div/main/div[2]/div/div/div/h2').text.lower()
-            if specialty.split()[0] not in specialties:
-                continue
-
             # Get each row data
             applicants = []
             for content in table:
@@ -209,72 +202,144 @@ class Admission(commands.Cog, name="admission"):
                 row = [row[0].split()[0]] + [row[1]] + similar[0:3] + [exams_score] + similar[3:] + ['-', '-']
                 applicants.append(row)
             applicants_tables[specialty] = applicants
+            if timings is not None:
+                timings[specialty] = time.perf_counter() - start
 
-        # Close web driver and return tables
-        driver.quit()
         return applicants_tables
 
-    async def upload_data(self, university, applicants_tables, update_time: datetime):
-        """Uploads the table to the main Google Spreadsheet
+    def sheets_request(self, function, body: dict, counters: dict):
+        """Sends the request to the Google Sheets API, retries with exponential backoff on quota and server errors
 
-        :param university: str - Name of the university (future name of the sheet in the table)
-        :param applicants_tables: dict - Tables of university applicants by specialties
-        :param update_time: datetime - Time of last update"""
-        # Get worksheet object (create new or get old one)
-        try:
-            worksheet = self.spreadsheet.add_worksheet(title=university, rows='2000', cols='500')
-        except gspread.exceptions.APIError:
-            worksheet = self.spreadsheet.worksheet(title=university)
+        Runs in the Sheets thread (blocking).
 
-        # Main
-        row0, col0 = 1, 1
+        :param function: function - Spreadsheet method taking the request body
+        :param body: dict - Request body
+        :param counters: dict - {calls, bytes, retries} of the university, updated with every attempt
+        :return: dict - API response
+        """
+        size = len(json.dumps(body, ensure_ascii=False).encode())
+        for attempt in range(self.sheets_retries + 1):
+            counters['calls'] += 1
+            counters['bytes'] += size
+            try:
+                return function(body)
+            except gspread.exceptions.APIError as error:
+                if error.response.status_code not in (429, 500, 502, 503) or attempt == self.sheets_retries:
+                    raise
+                counters['retries'] += 1
+                time.sleep(self.sheets_backoff * 2 ** attempt)
+
+    def get_worksheet(self, title: str, counters: dict):
+        """Returns the worksheet from the cache, the cache is filled with one request, missing sheets are added
+
+        Runs in the Sheets thread (blocking).
+
+        :param title: str - Sheet name
+        :param counters: dict - {calls, bytes, retries} of the university
+        """
+        if self.worksheets is None:
+            counters['calls'] += 1
+            self.worksheets = {worksheet.title: worksheet for worksheet in self.spreadsheet.worksheets()}
+        if title not in self.worksheets:
+            counters['calls'] += 1
+            self.worksheets[title] = self.spreadsheet.add_worksheet(title=title, rows='2000', cols='500')
+        return self.worksheets[title]
+
+    def write_tables(self, university, applicants_tables: dict, update_time: datetime, counters: dict):
+        """Writes the tables of the university with one values request and one formatting request
+
+        Runs in the Sheets thread (blocking).
+        """
+        worksheet = self.get_worksheet(university, counters)
+
+        # Values and formatting of all specialties
         titles = [
             '№', 'СНИЛС / Код', 'Приоритет', 'Условия', 'Σ общая', 'Σ ЕГЭ', 'Σ ИД',
             'ЕГЭ 1', 'ЕГЭ 2', 'ЕГЭ 3', 'Согласие', 'ПП', 'ИД', 'Примечания'
         ]
+        border = {'style': 'SOLID', 'width': 1}
+        data, requests = [], []
+        row0, col0 = 1, 1
         for specialty, applicants in applicants_tables.items():
-            # Get current table range
+            # Current table range
+            rows = [[specialty] + [''] * 13, titles] + [list(row) for row in applicants]
             start = rowcol_to_a1(row0, col0)
-            end = rowcol_to_a1(row0 + 1 + len(applicants), col0 + 13)
-
-            # GSpread data updater, cycle breaks after 1st successful completion
-            data = [[specialty] + [''] * 13, titles] + applicants
-            while True:
-                try:
-                    # Update table
-                    worksheet.update(f"{start}:{end}", data)
-
-                    # Update whole table format
-                    worksheet.format(f"{start}:{end}", {
+            end = rowcol_to_a1(row0 + len(rows) - 1, col0 + 13)
+            data.append({'range': f"'{university}'!{start}:{end}", 'values': rows})
+
+            def grid(first_row, last_row):
+                return {
+                    'sheetId': worksheet.id,
+                    'startRowIndex': first_row - 1, 'endRowIndex': last_row,
+                    'startColumnIndex': col0 - 1, 'endColumnIndex': col0 + 13
+                }
+
+            requests += [
+                # Whole table format
+                {'repeatCell': {
+                    'range': grid(row0, row0 + len(rows) - 1),
+                    'cell': {'userEnteredFormat': {
                         'textFormat': {'fontSize': 11},
-                        'borders': {
-                            'top': {'style': 'SOLID', 'width': 1},
-                            'bottom': {'style': 'SOLID', 'width': 1},
-                            'left': {'style': 'SOLID', 'width': 1},
-                            'right': {'style': 'SOLID', 'width': 1}
-                        },
-                        'horizontalAlignment': 'CENTER',
-                    })
-
-                    # Update title format
-                    title_range = f"{start}:{rowcol_to_a1(row0, col0 + 13)}"
-                    worksheet.merge_cells(title_range, merge_type="MERGE_ALL")
-                    worksheet.format(title_range, {'textFormat': {'fontSize': 13, 'bold': True}})
-
-                    # Update header format
-                    header_range = f"{rowcol_to_a1(row0 + 1, col0)}:{rowcol_to_a1(row0 + 1, col0 + 13)}"
-                    worksheet.format(header_range, {'textFormat': {'fontSize': 12}})
-
-                    # Auto resize whole table
-                    worksheet.columns_auto_resize(col0, col0 + 13)
-                except gspread.exceptions.APIError:
-                    await asyncio.sleep(delay=60)
-                else:
-                    break
+                        'borders': {'top': border, 'bottom': border, 'left': border, 'right': border},
+                        'horizontalAlignment': 'CENTER'
+                    }},
+                    'fields': 'userEnteredFormat(textFormat,borders,horizontalAlignment)'
+                }},
+                # Title format
+                {'mergeCells': {'range': grid(row0, row0), 'mergeType': 'MERGE_ALL'}},
+                {'repeatCell': {
+                    'range': grid(row0, row0),
+                    'cell': {'userEnteredFormat': {'textFormat': {'fontSize': 13, 'bold': True}}},
+                    'fields': 'userEnteredFormat.textFormat'
+                }},
+                # Header format
+                {'repeatCell': {
+                    'range': grid(row0 + 1, row0 + 1),
+                    'cell': {'userEnteredFormat': {'textFormat': {'fontSize': 12}}},
+                    'fields': 'userEnteredFormat.textFormat'
+                }},
+                # Auto resize whole table
+                {'autoResizeDimensions': {'dimensions': {
+                    'sheetId': worksheet.id, 'dimension': 'COLUMNS', 'startIndex': col0 - 1, 'endIndex': col0 + 13
+                }}}
+            ]
 
             # Next start position
             row0, col0 = 1, col0 + 15
-        worksheet.update('O1:O2', [['Обновлено'], [update_time.strftime('%H:%M %d.%m.%y')]])
+        data.append({
+            'range': f"'{university}'!O1:O2", 'values': [['Обновлено'], [update_time.strftime('%H:%M %d.%m.%y')]]
+        })
+
+        # Upload
+        try:
+            self.sheets_request(
+                self.spreadsheet.values_batch_update, {'valueInputOption': 'RAW', 'data': data}, counters
+            )
+            self.sheets_request(self.spreadsheet.batch_update, {'requests': requests}, counters)
+        except gspread.exceptions.APIError:
+            self.worksheets = None  # The sheet may have been deleted or renamed, read them again next time
+            raise
+
+    async def upload_data(self, university, applicants_tables, update_time: datetime):
+        """Uploads the table to the main Google Spreadsheet
+
+        All values of the university are written with one request and all formatting with another one,
+        the requests are sent from the Sheets thread so the event loop doesn't wait for them.
+
+        :param university: str - Name of the university (future name of the sheet in the table)
+        :param applicants_tables: dict - Tables of university applicants by specialties
+        :param update_time: datetime - Time of last update
+        :return: dict - {calls, bytes, retries, duration} of the upload
+        """
+        counters = {'calls': 0, 'bytes': 0, 'retries': 0, 'duration': 0}
+        start = time.perf_counter()
+        try:
+            await self.bot.loop.run_in_executor(
+                self.sheets_executor, self.write_tables, university, applicants_tables, update_time, counters
+            )
+        finally:
+            counters['duration'] = time.perf_counter() - start
+        return counters
 
     @tasks.loop(minutes=30)
     async def applicants_table_updater(self, specialties):
@@ -282,27 +347,67 @@ class Admission(commands.Cog, name="admission"):
 
         :param specialties: list of str - list of specialties
         """
-        # Get tables
-        data = {}
-        if 'СПбГЭТУ' in specialties.keys():
-            data['СПбГЭТУ'] = await self.get_spbetu_lists(specialties['СПбГЭТУ'])
-        if 'СПбГУ' in specialties.keys():
-            data['СПбГУ'] = await self.get_spbu_lists(specialties['СПбГУ'])
-        if 'ИТМО' in specialties.keys():
-            data['ИТМО'] = await self.get_itmo_lists(specialties['ИТМО'])
-
-        timezone(timedelta(hours=3), name='МСК')
-        update_time = datetime.now()
-
-        # Main
-        for university, applicants_tables in data.items():
-            # Error handler
-            if not isinstance(applicants_tables, dict):
-                continue
+        trigger.set('loop:applicants_table_updater')
+        stats = {}
+
+        async def scrape(university):
+            """Returns tables of the university, a failure doesn't affect other universities"""
+            stats[university] = {'duration': 0, 'error': None, 'specialties': {}, 'upload': None}
+            timings = stats[university]['specialties']
+            start = time.perf_counter()
+            try:
+                if university == 'СПбГЭТУ':
+                    return university, await self.get_spbetu_lists(specialties[university], timings)
+                if university == 'СПбГУ':
+                    return university, await self.get_spbu_lists(specialties[university], timings)
+                if university == 'ИТМО':
+                    return university, await self.browser.run(self.get_itmo_lists, specialties[university], timings)
+                return university, {}
+            except Exception as error:
+                stats[university]['error'] = repr(error)
+                traceback.print_exception(type(error), error, error.__traceback__)
+                return university, {}
+            finally:
+                stats[university]['duration'] = time.perf_counter() - start
+
+        # Universities are scraped concurrently, each one is uploaded as soon as its tables are ready
+        universities = [university for university in ('СПбГЭТУ', 'СПбГУ', 'ИТМО') if university in specialties]
+        for future in asyncio.as_completed([scrape(university) for university in universities]):
+            university, applicants_tables = await future
+
+            timezone(timedelta(hours=3), name='МСК')
+            update_time = datetime.now()
 
             # Data upload
             if applicants_tables:
-                await self.upload_data(university, applicants_tables, update_time)
+                try:
+                    stats[university]['upload'] = await self.upload_data(university, applicants_tables, update_time)
+                except gspread.exceptions.APIError as error:
+                    stats[university]['error'] = repr(error)
+                    traceback.print_exception(type(error), error, error.__traceback__)
+
+            # Timings
+            timings = stats[university]['specialties']
+            slowest = max(timings.items(), key=lambda item: item[1], default=(None, 0))
+            print(
+                f"{university}: {len(applicants_tables)}/{len(timings)} specialties in "
+                f"{stats[university]['duration']:.2f}s, slowest {slowest[0]} ({slowest[1]:.2f}s)"
+                + (f", failed: {stats[university]['error']}" if stats[university]['error'] else '')
+            )
+            upload = stats[university]['upload']
+            if upload:
+                print(
+                    f"{university}: uploaded in {upload['duration']:.2f}s, {upload['calls']} API calls "
+                    f"({upload['retries']} retries), {upload['bytes'] / 1024:.1f} KiB"
+                )
+        self.scrape_stats = stats
+
+        # Sheets quota usage of the cycle
+        uploads = [university_stats['upload'] for university_stats in stats.values() if university_stats['upload']]
+        print(
+            f"Sheets: {sum(upload['calls'] for upload in uploads)} API calls, "
+            f"{sum(upload['bytes'] for upload in uploads) / 1024:.1f} KiB in the cycle"
+        )
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -311,9 +416,8 @@ class Admission(commands.Cog, name="admission"):
             return
 
         # Get university-specialty pairs from database
-        self.cursor.execute("SELECT * FROM specialty_upload;")
         specialties = {}
-        for key, value in self.cursor.fetchall():
+        for key, value in await self.bot.db.fetchall("SELECT * FROM specialty_upload;"):
             if key in specialties.keys():
                 specialties[key].append(value)
             else:
@@ -352,16 +456,15 @@ class Admission(commands.Cog, name="admission"):
         # Database update
         for specialty in args:
             try:
-                self.cursor.execute("INSERT INTO specialty_upload VALUES (%s, %s);", (university, specialty))
+                await self.bot.db.execute("INSERT INTO specialty_upload VALUES (%s, %s);", (university, specialty))
             except psycopg2.errors.UniqueViolation:
                 continue
             except psycopg2.errors.ForeignKeyViolation:
                 raise commands.BadArgument(f"**{university}** is a wrong university name")
 
         # Get university-specialty pairs from database
-        self.cursor.execute("SELECT * FROM specialty_upload;")
         specialties = {}
-        for key, value in self.cursor.fetchall():
+        for key, value in await self.bot.db.fetchall("SELECT * FROM specialty_upload;"):
             if key in specialties.keys():
                 specialties[key].append(value)
             else:
@@ -409,23 +512,22 @@ class Admission(commands.Cog, name="admission"):
         # Database update
         if '*' in args:
             if university == '*':
-                self.cursor.execute("DELETE FROM specialty_upload;")
+                await self.bot.db.execute("DELETE FROM specialty_upload;")
             else:
-                self.cursor.execute("DELETE FROM specialty_upload WHERE university_name=%s;", (university, ))
+                await self.bot.db.execute("DELETE FROM specialty_upload WHERE university_name=%s;", (university, ))
         else:
             for specialty in args:
                 if university == '*':
-                    self.cursor.execute("DELETE FROM specialty_upload WHERE specialty_code=%s;", (specialty, ))
+                    await self.bot.db.execute("DELETE FROM specialty_upload WHERE specialty_code=%s;", (specialty, ))
                 else:
-                    self.cursor.execute(
+                    await self.bot.db.execute(
                         "DELETE FROM specialty_upload WHERE university_name=%s AND specialty_code=%s;",
                         (university, specialty)
                     )
 
         # Get university-specialty pairs from database
-        self.cursor.execute("SELECT * FROM specialty_upload;")
         specialties = {}
-        for key, value in self.cursor.fetchall():
+        for key, value in await self.bot.db.fetchall("SELECT * FROM specialty_upload;"):
             if key in specialties.keys():
                 specialties[key].append(value)
             else:
@@ -486,6 +588,32 @@ class Admission(commands.Cog, name="admission"):
             description="**Total updates:** " + str(self.applicants_table_updater.current_loop),
             color=self.bot.ColorDefault
         )
+        # Timings of the last cycle
+        for university, stats in self.scrape_stats.items():
+            value = f"**{stats['duration']:.2f}**s" + (f", failed: {stats['error']}" if stats['error'] else '')
+            if stats['upload']:
+                value += (
+                    f"\nUpload: **{stats['upload']['duration']:.2f}**s, {stats['upload']['calls']} API calls "
+                    f"({stats['upload']['retries']} retries), {stats['upload']['bytes'] / 1024:.1f} KiB"
+                )
+            for specialty, seconds in stats['specialties'].items():
+                value += f"\n`{seconds:5.2f}s` {specialty[:60]}"
+            embed.add_field(name=university, value=value[:1024], inline=False)
+
+        # Browser
+        browser = self.browser
+        average = browser.busy_time / browser.calls if browser.calls else 0
+        embed.add_field(
+            name="Browser",
+            value=(
+                f"{'Running' if browser.driver else 'Stopped'}, **{browser.memory() / 2 ** 20:.0f}** MiB\n"
+                f"Starts: **{browser.starts}** (last {browser.start_time:.1f}s), "
+                f"calls: **{browser.calls}** ({browser.errors} failed), "
+                f"{average:.1f}s avg, {browser.last_call_time:.1f}s last"
+            ),
+            inline=False
+        )
+
         # Data for developers
         embed.description += "\nCurrent task (for developers): \n||"
         embed.description += str(self.applicants_table_updater.get_task()) + "||"
@@ -493,6 +621,12 @@ class Admission(commands.Cog, name="admission"):
         # Message send
         await ctx.send(embed=embed)
 
+    async def close(self):
+        """Stops the parser processes, the browser and the Sheets thread"""
+        self.parse_pool.shutdown(wait=False)
+        self.sheets_executor.shutdown(wait=False)
+        await self.browser.close()
+
 
 def setup(bot):
     bot.add_cog(Admission(bot))
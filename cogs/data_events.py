@@ -1,89 +1,287 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import discord
 from discord.ext import commands
-import psycopg2
-from urllib.parse import urlparse
+from psycopg2.extras import execute_values
 import os
+import time
+from utils.write_queue import WriteBehindQueue
 
 
 class DataEvents(commands.Cog):
     """Responsible for the automatic collection of data"""
+    # Removes the guild, its members and the users that have no member objects in other guilds
+    # (one round trip, set-based, works for any number of members including zero)
+    GUILD_REMOVE = (
+        "WITH removed_members AS ("
+        "DELETE FROM ds_member WHERE guild_id=%(guild_id)s RETURNING user_id"
+        ") "
+        "DELETE FROM ds_user WHERE user_id IN (SELECT user_id FROM removed_members) AND NOT EXISTS ("
+        "SELECT 1 FROM ds_member WHERE ds_member.user_id=ds_user.user_id AND ds_member.guild_id<>%(guild_id)s"
+        "); "
+        "DELETE FROM ds_guild WHERE guild_id=%(guild_id)s;"
+    )
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-        # Postgres connection
-        result = urlparse(os.environ['DATABASE_URL'])
-        with psycopg2.connect(
-            dbname=result.path[1:],
-            user=result.username,
-            password=result.password,
-            host=result.hostname,
-            port=result.port
-        ) as connection:
-            connection.autocommit = True
-            self.cursor = connection.cursor()
+        # Write-behind queue of listener changes
+        self.queue = WriteBehindQueue(self.bot.db, max_size=int(os.environ.get('WRITE_QUEUE_SIZE', 10000)))
+        self.queue.start()
 
-    @commands.Cog.listener()
-    async def on_guild_join(self, guild: discord.Guild):
-        """Creates a server object and collects all information associated with it"""
+        # Reconciliation with the gateway cache is running
+        self.reconciling = False
+
+        # Progress of running bulk ingests: {guild_id: {table: [inserted, total]}} (logged every interval seconds)
+        self.ingest_progress = {}
+        self.ingest_log_interval = 10
+
+    def guild_rows(self, guild: discord.Guild):
+        """Returns database rows of the guild from the gateway cache
+
+        :param guild: discord.Guild - Guild
+        :return: tuple - ([ds_guild rows], [ds_channel rows], [ds_user rows], [ds_member rows])
+        """
         # Guild data
-        self.cursor.execute("INSERT INTO ds_guild VALUES (%s, %s);", (guild.id, guild.name))
+        guilds = [(guild.id, guild.name)]
 
         # Guild channels
+        channels = []
         for channel in guild.channels:
-            if channel not in guild.categories:
+            if not isinstance(channel, discord.CategoryChannel):
                 category_id = channel.category.id if channel.category else None
                 is_system = channel.id == guild.system_channel.id if guild.system_channel else False
-                self.cursor.execute(
-                    "INSERT INTO ds_channel VALUES (%s, %s, %s, %s, %s, NULL, %s);",
-                    (channel.id, guild.id, category_id, channel.name, str(channel.type), is_system)
-                )
+                channels.append((channel.id, guild.id, category_id, channel.name, str(channel.type), is_system))
 
         # Guild members and bot users
+        users, members = [], []
         for member in guild.members:
             user = self.bot.get_user(member.id)
-            self.cursor.execute(
-                "INSERT INTO ds_user VALUES (%s, %s) ON CONFLICT DO NOTHING;",
-                (user.id, user.name)
+            users.append((user.id, user.name))
+            members.append((member.id, guild.id, member.id == guild.owner_id))
+
+        return guilds, channels, users, members
+
+    @staticmethod
+    def reconcile(connection, guilds, channels, users, members, unavailable=()):
+        """Brings the database in line with the gateway cache in one transaction (runs in a database thread)
+
+        Rows are removed only for guilds that are in the snapshot, unavailable guilds are left as they are.
+
+        :param connection: psycopg2.extensions.connection - Pool connection
+        :param guilds: list of tuples - ds_guild rows of all guilds
+        :param channels: list of tuples - ds_channel rows (without lesson_name) of all guilds
+        :param users: list of tuples - ds_user rows of all guilds
+        :param members: list of tuples - ds_member rows of all guilds
+        :param unavailable: collection of int - IDs of the guilds that are unavailable (their cache is empty)
+        :return: dict - {action: number of rows}
+        """
+        guilds = {row[0]: row for row in guilds}
+        channels = {row[0]: row for row in channels}
+        users = {row[0]: row for row in users}
+        members = {row[:2]: row for row in members}
+
+        with connection.cursor() as cursor:
+            # Database state
+            cursor.execute("SELECT guild_id, guild_name FROM ds_guild;")
+            db_guilds = dict(cursor.fetchall())
+            cursor.execute("SELECT channel_id, guild_id, category_id, channel_name FROM ds_channel;")
+            db_channels = {row[0]: row for row in cursor.fetchall()}
+            cursor.execute("SELECT user_id, user_name FROM ds_user;")
+            db_users = dict(cursor.fetchall())
+            cursor.execute("SELECT user_id, guild_id FROM ds_member;")
+            db_members = set(cursor.fetchall())
+
+            # Differences
+            new_guilds = [row for guild_id, row in guilds.items() if guild_id not in db_guilds]
+            renamed_guilds = [
+                row for guild_id, row in guilds.items() if guild_id in db_guilds and db_guilds[guild_id] != row[1]
+            ]
+            removed_guilds = [
+                guild_id for guild_id in db_guilds if guild_id not in guilds and guild_id not in unavailable
+            ]
+            new_channels = [row for channel_id, row in channels.items() if channel_id not in db_channels]
+            changed_channels = [
+                (row[0], row[2], row[3]) for channel_id, row in channels.items()
+                if channel_id in db_channels and db_channels[channel_id][2:] != (row[2], row[3])
+            ]
+            removed_channels = [
+                channel_id for channel_id, row in db_channels.items()
+                if channel_id not in channels and row[1] in guilds
+            ]
+            new_users = [row for user_id, row in users.items() if user_id not in db_users]
+            renamed_users = [
+                row for user_id, row in users.items() if user_id in db_users and db_users[user_id] != row[1]
+            ]
+            new_members = [row for key, row in members.items() if key not in db_members]
+            removed_members = [key for key in db_members if key not in members and key[1] in guilds]
+
+            # Inserts
+            execute_values(cursor, "INSERT INTO ds_guild VALUES %s ON CONFLICT DO NOTHING;", new_guilds)
+            execute_values(
+                cursor, "INSERT INTO ds_channel VALUES %s ON CONFLICT DO NOTHING;", new_channels,
+                template="(%s, %s, %s, %s, %s, NULL, %s)"
+            )
+            execute_values(cursor, "INSERT INTO ds_user VALUES %s ON CONFLICT DO NOTHING;", new_users)
+            execute_values(cursor, "INSERT INTO ds_member VALUES %s ON CONFLICT DO NOTHING;", new_members)
+
+            # Updates
+            execute_values(
+                cursor,
+                "UPDATE ds_guild SET guild_name=v.name FROM (VALUES %s) AS v(id, name) WHERE guild_id=v.id;",
+                renamed_guilds
+            )
+            execute_values(
+                cursor,
+                "UPDATE ds_channel SET category_id=v.category_id, channel_name=v.name "
+                "FROM (VALUES %s) AS v(id, category_id, name) WHERE channel_id=v.id;",
+                changed_channels, template="(%s, %s::bigint, %s)"
             )
-            is_owner = member.id == member.guild.owner_id
-            self.cursor.execute(
-                "INSERT INTO ds_member VALUES (%s, %s, %s);",
-                (member.id, member.guild.id, is_owner)
+            execute_values(
+                cursor,
+                "UPDATE ds_user SET user_name=v.name FROM (VALUES %s) AS v(id, name) WHERE user_id=v.id;",
+                renamed_users
             )
 
+            # Deletes (users are deleted when they have no member objects left)
+            execute_values(
+                cursor,
+                "DELETE FROM ds_member USING (VALUES %s) AS v(user_id, guild_id) "
+                "WHERE ds_member.user_id=v.user_id AND ds_member.guild_id=v.guild_id;",
+                removed_members
+            )
+            cursor.execute("DELETE FROM ds_channel WHERE channel_id = ANY(%s);", (removed_channels, ))
+            cursor.execute("DELETE FROM ds_guild WHERE guild_id = ANY(%s);", (removed_guilds, ))
+            cursor.execute(
+                "DELETE FROM ds_user WHERE NOT EXISTS "
+                "(SELECT 1 FROM ds_member WHERE ds_member.user_id=ds_user.user_id);"
+            )
+            removed_users = cursor.rowcount
+
+        return {
+            'guilds +': len(new_guilds), 'guilds ~': len(renamed_guilds), 'guilds -': len(removed_guilds),
+            'channels +': len(new_channels), 'channels ~': len(changed_channels), 'channels -': len(removed_channels),
+            'users +': len(new_users), 'users ~': len(renamed_users), 'users -': removed_users,
+            'members +': len(new_members), 'members -': len(removed_members)
+        }
+
+    def bulk_ingest(
+            self, connection, guild_id: int, guilds, channels, users, members, progress: dict, page_size: int = 1000
+    ):
+        """Inserts guild data with multi-row statements in one transaction (runs in a database thread)
+
+        :param connection: psycopg2.extensions.connection - Pool connection
+        :param guild_id: int - Guild's ID
+        :param guilds: list of tuples - ds_guild rows
+        :param channels: list of tuples - ds_channel rows (without lesson_name)
+        :param users: list of tuples - ds_user rows
+        :param members: list of tuples - ds_member rows
+        :param progress: dict - Progress of ingests, updated as {guild_id: {table: [inserted, total]}}
+        :param page_size: int - Rows in one statement
+        """
+        tables = (
+            ('ds_guild', "INSERT INTO ds_guild VALUES %s ON CONFLICT DO NOTHING;", None, guilds),
+            (
+                'ds_channel', "INSERT INTO ds_channel VALUES %s ON CONFLICT DO NOTHING;",
+                "(%s, %s, %s, %s, %s, NULL, %s)", channels
+            ),
+            ('ds_user', "INSERT INTO ds_user VALUES %s ON CONFLICT DO NOTHING;", None, users),
+            ('ds_member', "INSERT INTO ds_member VALUES %s ON CONFLICT DO NOTHING;", None, members)
+        )
+        progress[guild_id] = {table: [0, len(rows)] for table, _, _, rows in tables}
+
+        with connection.cursor() as cursor:
+            for table, query, template, rows in tables:
+                for start in range(0, len(rows), page_size):
+                    page = rows[start:start + page_size]
+                    with self.bot.db.measure(query):
+                        execute_values(cursor, query, page, template=template, page_size=page_size)
+                    progress[guild_id][table][0] += len(page)
+
+    @staticmethod
+    def progress_text(progress: dict):
+        """Returns the progress of the ingest as 'table inserted/total, ...'"""
+        return ', '.join(f"{table} {inserted}/{total}" for table, (inserted, total) in progress.items())
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        """Creates a server object and collects all information associated with it"""
+        start = time.perf_counter()
+
+        # Guild data, channels, members and bot users
+        guilds, channels, users, members = self.guild_rows(guild)
+
+        # Insert everything off the event loop (progress of a large ingest is logged while it runs)
+        ingest = asyncio.ensure_future(
+            self.bot.db.run(self.bulk_ingest, guild.id, guilds, channels, users, members, self.ingest_progress)
+        )
+        try:
+            while not (await asyncio.wait({ingest}, timeout=self.ingest_log_interval))[0]:
+                print(
+                    f"Guild {guild.id} ingest, {time.perf_counter() - start:.0f}s: "
+                    + self.progress_text(self.ingest_progress.get(guild.id, {}))
+                )
+            await ingest
+        finally:
+            progress = self.ingest_progress.pop(guild.id, {})
+        print(f"Guild {guild.id} ingested in {time.perf_counter() - start:.2f}s: " + self.progress_text(progress))
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Applies the changes that happened while the bot was offline"""
+        if self.reconciling:
+            return
+        self.reconciling = True
+        try:
+            # Queued changes are written after the reconciliation commits: a change flushed between the snapshot
+            # and the read of the database state would be undone (e.g. a member that has joined meanwhile deleted)
+            async with self.queue.lock:
+                start = time.perf_counter()
+
+                # Snapshot of the gateway cache (yielding to the gateway between guilds), guilds that are unavailable
+                # (outage or GUILD_CREATE not received yet) have no name, channels and members in the cache
+                guilds, channels, users, members, unavailable = [], [], [], [], set()
+                for guild in self.bot.guilds:
+                    if guild.unavailable:
+                        unavailable.add(guild.id)
+                        continue
+                    for rows, guild_rows in zip((guilds, channels, users, members), self.guild_rows(guild)):
+                        rows += guild_rows
+                    await asyncio.sleep(0)
+
+                # Apply differences off the event loop
+                counts = await self.bot.db.run(self.reconcile, guilds, channels, users, members, unavailable)
+                print(
+                    f"Database reconciled with {len(guilds)} guilds ({len(unavailable)} unavailable skipped) "
+                    f"in {time.perf_counter() - start:.2f}s: "
+                    + ', '.join(f"{action} {count}" for action, count in counts.items())
+                )
+        finally:
+            self.reconciling = False
+
     @commands.Cog.listener()
     async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
         """Called when a guild changes: name, AFK channel, AFK timeout, etc"""
         if before.name != after.name:
-            self.cursor.execute("UPDATE ds_guild SET guild_name=%s WHERE guild_id=%s;", (after.name, after.id))
+            await self.queue.put(
+                "UPDATE ds_guild SET guild_name=%s WHERE guild_id=%s;", (after.name, after.id), key=('ds_guild', after.id)
+            )
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild):
         """Called when a guild is removed from the client"""
-        # Current guild members
-        self.cursor.execute("SELECT user_id FROM ds_member WHERE guild_id=%s;", (guild.id, ))
-        guild_members = tuple(user_id[0] for user_id in self.cursor.fetchall())
-
-        # Guild remove
-        self.cursor.execute("DELETE FROM ds_guild WHERE guild_id=%s;", (guild.id, ))  # Guild remove
-
-        # Same users in another guilds
-        self.cursor.execute("SELECT user_id FROM ds_member WHERE user_id IN %s;", (guild_members, ))
-        another_guild_members = tuple(user_id[0] for user_id in self.cursor.fetchall())
-
-        # Users without member objects remove
-        deleted_users = tuple(member for member in guild_members if member not in another_guild_members)
-        self.cursor.execute("DELETE FROM ds_user WHERE user_id IN %s;", (deleted_users, ))
+        # Guild remove with its members and users without member objects (queued after pending changes of the guild)
+        await self.queue.put(self.GUILD_REMOVE, {'guild_id': guild.id})
+        self.bot.guild_config.forget(guild.id)
 
     @commands.Cog.listener()
     async def on_guild_channel_create(self, channel):
         """Called when a guild channel is created"""
         if isinstance(channel, discord.TextChannel) or isinstance(channel, discord.VoiceChannel):
             category_id = channel.category.id if channel.category else None
-            self.cursor.execute(
-                "INSERT INTO ds_channel VALUES (%s, %s, %s, %s, %s);",
+            await self.queue.put(
+                "INSERT INTO ds_channel VALUES (%s, %s, %s, %s, %s) ON CONFLICT DO NOTHING;",
                 (channel.id, channel.guild.id, category_id, channel.name, str(channel.type))
             )
 
@@ -92,39 +290,33 @@ class DataEvents(commands.Cog):
         """Called whenever a guild channel changes: name, topic, perms, etc"""
         if isinstance(before, discord.TextChannel) or isinstance(before, discord.VoiceChannel):
             category_id = after.category.id if after.category else None
-            self.cursor.execute(
+            await self.queue.put(
                 "UPDATE ds_channel SET channel_name=%s, category_id=%s WHERE channel_id=%s;",
-                (after.name, category_id, after.id)
+                (after.name, category_id, after.id),
+                key=('ds_channel', after.id)
             )
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel: discord.GroupChannel):
         """Called when a guild channel is deleted"""
         if isinstance(channel, discord.TextChannel) or isinstance(channel, discord.VoiceChannel):
-            self.cursor.execute("DELETE FROM ds_channel WHERE channel_id=%s;", (channel.id, ))
+            await self.queue.put("DELETE FROM ds_channel WHERE channel_id=%s;", (channel.id, ))
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         """Called when a member joins a Guild"""
         # Add user to database if doesn't exist
-        self.cursor.execute("SELECT 1 FROM ds_user WHERE user_id=%s;", (member.id, ))
-        user_exists = self.cursor.fetchone()
-        if not user_exists:  # Add user to database if doesn't exist
-            user = self.bot.get_user(member.id)
-            self.cursor.execute(
-                "INSERT INTO ds_user VALUES (%s, %s);",
-                (user.id, user.name)
-            )
+        user = self.bot.get_user(member.id)
+        await self.queue.put("INSERT INTO ds_user VALUES (%s, %s) ON CONFLICT DO NOTHING;", (user.id, user.name))
 
-        self.cursor.execute(
-            "INSERT INTO ds_member VALUES (%s, %s, %s);",
+        await self.queue.put(
+            "INSERT INTO ds_member VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;",
             (member.id, member.guild.id, member.id == member.guild.owner_id)
         )
 
         # Send greeting message
-        self.cursor.execute("SELECT is_greetings FROM ds_guild WHERE guild_id=%s;", (member.guild.id, ))
-        is_greetings = self.cursor.fetchone()[0]
-        if is_greetings and member.guild.system_channel:
+        config = await self.bot.guild_config.get(member.guild.id)
+        if config and config['is_greetings'] and member.guild.system_channel:
             await member.guild.system_channel.send(f"{member.mention} has **joined** a server")
 
     @commands.Cog.listener()
@@ -136,28 +328,30 @@ class DataEvents(commands.Cog):
     async def on_member_remove(self, member: discord.Member):
         """Called when a member leaves a Guild"""
         # Delete member
-        self.cursor.execute("DELETE FROM ds_member WHERE user_id=%s AND guild_id=%s;", (member.id, member.guild.id))
+        await self.queue.put("DELETE FROM ds_member WHERE user_id=%s AND guild_id=%s;", (member.id, member.guild.id))
 
         # Delete user if member was last user object
-        self.cursor.execute("SELECT 1 FROM ds_member WHERE user_id=%s;", (member.id, ))
-        user_exists = self.cursor.fetchone()
-        if not user_exists:
-            self.cursor.execute("DELETE FROM ds_user WHERE user_id=%s;", (member.id, ))
+        await self.queue.put(
+            "DELETE FROM ds_user WHERE user_id=%s AND NOT EXISTS (SELECT 1 FROM ds_member WHERE user_id=%s);",
+            (member.id, member.id)
+        )
 
         # Send greeting message
-        self.cursor.execute("SELECT is_greetings FROM ds_guild WHERE guild_id=%s;", (member.guild.id,))
-        is_greetings = self.cursor.fetchone()[0]
-        if is_greetings and member.guild.system_channel and not member == self.bot.user:
+        config = await self.bot.guild_config.get(member.guild.id)
+        if config and config['is_greetings'] and member.guild.system_channel and not member == self.bot.user:
             await member.guild.system_channel.send(f"{member.mention} has **left** a server")
 
     @commands.Cog.listener()
     async def on_user_update(self, before: discord.User, after: discord.User):
         """Called when user updates his: avatar, username, discriminator"""
-        self.cursor.execute(
-            "UPDATE ds_user SET user_name=%s WHERE user_id=%s;",
-            (after.name, after.id)
+        await self.queue.put(
+            "UPDATE ds_user SET user_name=%s WHERE user_id=%s;", (after.name, after.id), key=('ds_user', after.id)
         )
 
+    async def close(self):
+        """Writes pending changes before shutdown"""
+        await self.queue.close()
+
 
 def setup(bot):
     bot.add_cog(DataEvents(bot))
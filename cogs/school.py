@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+from collections import OrderedDict
 import discord
+import hashlib
+import json
 from discord.ext import commands, tasks
 from datetime import datetime, timedelta
 import os
-import requests
-import bs4
-from bs4 import BeautifulSoup
+import time
+import traceback
 import psycopg2
-from urllib.parse import urlparse
+from utils.profiler import trigger
+from utils.schedule import PARSERS, ScheduleRegistry
 
 
 class School(commands.Cog, name="school"):
@@ -17,17 +20,93 @@ class School(commands.Cog, name="school"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-        # Postgres connection
-        result = urlparse(os.environ['DATABASE_URL'])
-        with psycopg2.connect(
-            dbname=result.path[1:],
-            user=result.username,
-            password=result.password,
-            host=result.hostname,
-            port=result.port
-        ) as connection:
-            connection.autocommit = True
-            self.cursor = connection.cursor()
+        # Search index and settings (loaded before the event loop starts, tables are created by utils.migrations)
+        try:  # Trigram index for the homework search (the search still works without it, but slower)
+            self.bot.db.run_blocking(self.create_search_index)
+        except psycopg2.Error as error:  # No privilege to create the extension, contrib package isn't installed, etc
+            print(f"pg_trgm extension is not available, homework search will not use the index: {error}")
+        settings = self.bot.db.run_blocking(self.load_settings)
+
+        # Lesson channels: {channel_id: lesson_name}
+        self.lesson_channels = settings['lesson_channels']
+
+        # Distribution messages (used with the schedule channels of bot.guild_config to filter reactions)
+        self.distribution_messages = settings['distribution_messages']
+
+        # Lesson start times: {guild_id: {lesson_number: time}}
+        self.timetables = settings['timetables']
+
+        # Schedule sources (school websites), guilds are bound to them in ds_guild
+        self.schedule_sources = ScheduleRegistry(self.bot.web)
+        for name, url, parser in settings['schedule_sources']:
+            self.schedule_sources.register(name, url, parser)
+
+        # Hot statements (prepared on each connection of the pool)
+        self.homework_statement = self.bot.db.prepare(
+            'homework_by_date',
+            "SELECT lesson_name, date, content, files, source FROM homework "
+            "INNER JOIN ds_channel ON ds_channel.channel_id=homework.channel_id "
+            "WHERE homework.guild_id=$1 AND date BETWEEN $2 AND $3 AND lesson_name IS NOT NULL "
+            "ORDER BY message_id DESC;"
+        )
+        self.ledger_statement = self.bot.db.prepare(
+            'distribution_message_by_date',
+            "SELECT message_id, content_hash FROM distribution_message WHERE channel_id=$1 AND kind=$2 AND date=$3;"
+        )
+
+        # Refreshes of distribution messages: {message_id: asyncio.Task} and {message_id: time.monotonic()}
+        self.refreshes = {}
+        self.refreshed_at = {}
+        self.refresh_interval = 30
+
+        # Digests of recently posted distribution messages: {message_id: digest}
+        self.digests = OrderedDict()
+        self.digests_size = 256
+
+        # Schedule fingerprints: {(date, source, course): digest} and guilds whose settings have changed since the last tick
+        self.schedule_fingerprints = {}
+        self.dirty_guilds = set()
+
+        # Next check of the schedule page (the loop ticks every minute and skips until then)
+        self.next_poll = None
+
+        # Distribution settings and stats of the last tick
+        self.distribution_concurrency = int(os.environ.get('DISTRIBUTION_CONCURRENCY', 5))
+        self.distribution_stats = {}
+
+    @staticmethod
+    def create_search_index(connection):
+        """Creates the trigram index of homework content (runs in a transaction of a pool connection)"""
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS homework_content_trgm_idx ON homework USING GIN (content gin_trgm_ops);"
+            )
+
+    @staticmethod
+    def load_settings(connection):
+        """Returns the settings cached by the cog (runs in a transaction of a pool connection)
+
+        :return: dict - {lesson_channels, distribution_messages, timetables, schedule_sources}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT channel_id, lesson_name FROM ds_channel WHERE lesson_name IS NOT NULL;")
+            lesson_channels = {row[0]: row[1] for row in cursor.fetchall()}
+            cursor.execute("SELECT message_id FROM distribution_message;")
+            distribution_messages = {row[0] for row in cursor.fetchall()}
+            timetables = {}
+            cursor.execute("SELECT guild_id, lesson_number, time FROM timetable;")
+            for guild_id, lesson_number, time_ in cursor.fetchall():
+                timetables.setdefault(guild_id, {})[lesson_number] = time_
+            cursor.execute("SELECT source_name, url, parser FROM schedule_source;")
+            schedule_sources = cursor.fetchall()
+
+        return {
+            'lesson_channels': lesson_channels,
+            'distribution_messages': distribution_messages,
+            'timetables': timetables,
+            'schedule_sources': schedule_sources
+        }
 
     @staticmethod
     async def date_format(date: datetime):
@@ -38,6 +117,80 @@ class School(commands.Cog, name="school"):
         }
         return week[date.strftime('%a')].capitalize() + date.strftime(' %d.%m.%y')
 
+    @staticmethod
+    def homework_row(message_id: int, guild_id: int, channel_id: int, content: str, files: list, source: str):
+        """Returns the homework row of the message or None if it isn't a homework message
+
+        The message must start with the "дз DD.MM.YY" header, the rest of the message is the task.
+
+        :param message_id: int - Message ID
+        :param guild_id: int - Guild's ID
+        :param channel_id: int - Lesson channel ID
+        :param content: str - Message content
+        :param files: list of str - Attachment URLs
+        :param source: str - Message jump URL
+        :return: tuple - (message_id, guild_id, channel_id, date, content, files, source) or None
+        """
+        if "дз" not in content.lower():
+            return None
+        try:
+            date = datetime.strptime(content[3:11], '%d.%m.%y').date()
+        except ValueError:
+            return None
+        return (
+            message_id,
+            guild_id,
+            channel_id,
+            date,
+            content[content.find('\n'):] if '\n' in content else '',
+            files,
+            source
+        )
+
+    @classmethod
+    def parse_homework(cls, message: discord.Message):
+        """Returns the homework row of the message or None if it isn't a homework message
+
+        :param message: discord.Message - Message from the lesson channel
+        """
+        return cls.homework_row(
+            message.id, message.guild.id, message.channel.id, message.content,
+            [file.url for file in message.attachments], message.jump_url
+        )
+
+    async def index_homework(self, messages):
+        """Adds homework messages to the index, removes messages that are no longer homework
+
+        :param messages: list of discord.Message - Messages from the lesson channels
+        :return: int - Number of homework messages
+        """
+        rows, deleted = [], []
+        for message in messages:
+            row = self.parse_homework(message)
+            if row:
+                rows.append(row)
+            else:
+                deleted.append(message.id)
+        return await self.store_homework(rows, deleted)
+
+    async def store_homework(self, rows: list, deleted: list):
+        """Writes homework rows to the index and removes the messages that are no longer homework
+
+        :param rows: list of tuples - Homework rows (homework_row results)
+        :param deleted: list of int - IDs of the messages to remove
+        :return: int - Number of homework messages
+        """
+        if rows:
+            await self.bot.db.execute_values(
+                "INSERT INTO homework VALUES %s ON CONFLICT (message_id) DO UPDATE SET "
+                "date=EXCLUDED.date, content=EXCLUDED.content, files=EXCLUDED.files, source=EXCLUDED.source;",
+                rows
+            )
+        if deleted:
+            await self.bot.db.execute("DELETE FROM homework WHERE message_id = ANY(%s);", (deleted, ))
+
+        return len(rows)
+
     async def get_homework(self, guild_id: int, date1: datetime, date2: datetime = None):
         """Returns homework from guild in date range
 
@@ -50,38 +203,26 @@ class School(commands.Cog, name="school"):
         date2 = date2 or date1
         date_range = [(date1 + timedelta(days=x)).strftime('%d.%m.%y') for x in range(0, (date2 - date1).days + 1)]
 
-        # Get channels with homework from DB
-        self.cursor.execute(
-            "SELECT channel_id, lesson_name FROM ds_channel WHERE guild_id=%s AND lesson_name IS NOT NULL;", (guild_id,)
-        )
-        selected = self.cursor.fetchall()
+        # Get homework from the index (the oldest message of the day wins, as it was with the history scan)
+        rows = await self.bot.db.fetchall(self.homework_statement, (guild_id, date1.date(), date2.date()))
 
         # Main loop
         homework = {date: {} for date in date_range}
-        for channel_id, lesson in selected:
-            channel = self.bot.get_channel(channel_id)
-            async for message in channel.history():
-                if "дз" in message.content.lower():
-                    try:
-                        current = message.content[3:11]
-                        datetime.strptime(current, '%d.%m.%y')
-                    except ValueError:
-                        continue
-                    if current in date_range:
-                        homework[current][lesson.capitalize()] = {
-                            'content': message.content[message.content.find('\n'):] if '\n' in message.content else '',
-                            'files': [file.url for file in message.attachments],
-                            'source': message.jump_url
-                        }
-                    elif datetime.strptime(current, '%d.%m.%y') < datetime.strptime(date_range[0], '%d.%m.%y'):
-                        break
+        for lesson, date, content, files, source in rows:
+            homework[date.strftime('%d.%m.%y')][lesson.capitalize()] = {
+                'content': content,
+                'files': files,
+                'source': source
+            }
 
         return homework
 
-    async def get_schedule(self, date: datetime):
+    async def get_schedule(self, date: datetime, source: str = 'school36', revalidate: bool = False):
         """Returns the timetable from the school website
 
         :param date: datetime - The date for which you need to get the schedule
+        :param source: str - Schedule source name (school website)
+        :param revalidate: bool - Check the website even if the cached page is fresh
         :return: dict - {course: [lesson1, lesson2]} or RuntimeError
         """
         # Argument error handler
@@ -91,122 +232,295 @@ class School(commands.Cog, name="school"):
         if (date.month not in [today.month, today.month + 1]) or (date.year != today.year):
             return RuntimeError("Schedule not posted for the selected date")
 
-        # Get soup
-        response = requests.get(self.bot.ScheduleURL)
-        soup = BeautifulSoup(response.text, 'lxml')
-
-        # Get dates
-        dates = [h2.get_text().split()[-2] for h2 in soup.find_all('h2') if "Расписание" in h2.get_text()]
-        if str(date.day) not in dates:
+        # Get schedules from the cached page
+        try:
+            schedules = await self.schedule_sources[source].get(revalidate=revalidate)
+        except RuntimeError as error:
+            return error
+        if str(date.day) not in schedules:
             return RuntimeError("Schedule not posted for the selected date")
 
-        # Get schedules in HTML format for date
-        tables = [table for table in soup.find_all('tbody') if table.get_text().strip() != '']
-        pos = dates.index(str(date.day))
-        tables = [tables[pos*2], tables[pos*2 + 1]]
-
-        # Get schedule in dict format from tables
-        schedule = {}
-        for table in tables:
-            new_table = []
-            for row in table:  # Create table with replaced colspans
-                if isinstance(row, bs4.element.Tag):  # There are NavigableStrings in rows
-                    new_row = []
-                    for col in row:
-                        if isinstance(col, bs4.element.Tag):  # There are NavigableStrings in cols
-                            new_row.append(col.get_text().replace('\n', '').replace('\xa0', ''))
-                            if 'colspan' in col.attrs:  # Replace all cols with colspan
-                                for _ in range(int(col.attrs['colspan']) - 1):
-                                    new_row.append(col.get_text().replace('\n', '').replace('\xa0', ''))
-                    new_table.append(new_row)
-            new_table = [[new_table[j][i] for j in range(len(new_table))] for i in range(len(new_table[0]))]  # rot90
-            for row in new_table[1:]:
-                schedule[row[0]] = [lesson.capitalize() for lesson in row[1:]]
-
-        return schedule
-
-    @tasks.loop(minutes=15)
+        return schedules[str(date.day)]
+
+    @staticmethod
+    def embed_digest(embed: discord.Embed):
+        """Returns a stable digest of the embed content"""
+        return hashlib.sha1(json.dumps(embed.to_dict(), sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def homework_value(hw: dict):
+        """Returns homework text with links to the attached files"""
+        value = hw['content']
+        if hw['files']:
+            value += "\nПрикреплённые файлы: "
+            value += ', '.join(f"[№{index + 1}]({link})" for index, link in enumerate(hw['files']))
+        return value
+
+    def render_homework(self, title: str, homework: dict, description: str = None, url: str = None):
+        """Returns the distribution message content and its digest
+
+        :param title: str - Message title
+        :param homework: dict - {date: {lesson: {content: str, files: [str], source: str}} (get_homework result)
+        :param description: str - Schedule of the day (one-day message) or None (weekly homework message)
+        :param url: str - Schedule page URL (one-day message)
+        :return: tuple - (discord.Embed, str)
+        """
+        if description is None:  # Weekly homework, field for each date
+            embed = discord.Embed(title=title, color=self.bot.ColorDefault)
+            for date, lessons in homework.items():
+                values = ''
+                for lesson, hw in lessons.items():
+                    value = self.homework_value(hw)
+                    if value:
+                        values += f'**{lesson}**{value}\n'
+                embed.add_field(name=date, value=values or r'¯\_(ツ)_/¯ Ничего не задано')
+        else:  # Schedule, field for each lesson
+            embed = discord.Embed(
+                title=title,
+                description=description,
+                url=url,
+                color=self.bot.ColorDefault
+            )
+            for lessons in homework.values():
+                for lesson, hw in lessons.items():
+                    value = self.homework_value(hw)
+                    if value:
+                        embed.add_field(name=lesson, value=value, inline=False)
+
+        return embed, self.embed_digest(embed)
+
+    def remember_digest(self, message_id: int, digest: str):
+        """Saves the digest of the message content to the LRU of recent messages"""
+        self.digests[message_id] = digest
+        self.digests.move_to_end(message_id)
+        if len(self.digests) > self.digests_size:
+            self.digests.popitem(last=False)
+
+    async def posted_digest(self, message_id: int):
+        """Returns the digest of the distribution message content (None if unknown)"""
+        if message_id in self.digests:
+            self.digests.move_to_end(message_id)
+            return self.digests[message_id]
+        row = await self.bot.db.fetchone(
+            "SELECT content_hash FROM distribution_message WHERE message_id=%s;", (message_id, )
+        )
+        if row:
+            self.remember_digest(message_id, row[0])
+        return row[0] if row else None
+
+    async def publish(self, channel: discord.TextChannel, kind: str, date: datetime, embed: discord.Embed, digest: str):
+        """Sends the distribution message or edits the posted one if its content has changed
+
+        :param channel: discord.TextChannel - Schedule channel
+        :param kind: str - Distribution kind ('schedule' or 'weekly')
+        :param date: datetime - Date of the message (first date for weekly homework)
+        :param embed: discord.Embed - Message content
+        :param digest: str - Digest of the message content
+        """
+        posted = await self.bot.db.fetchone(self.ledger_statement, (channel.id, kind, date.date()))
+
+        # Message is up to date
+        if posted and posted[1] == digest:
+            self.remember_digest(posted[0], digest)
+            return
+
+        # Edit posted message or send the new one
+        message_id = posted[0] if posted else None
+        if message_id:
+            try:
+                await channel.get_partial_message(message_id).edit(embed=embed)
+            except discord.NotFound:
+                message_id = None
+        if not message_id:
+            message = await channel.send(embed=embed)
+            await message.add_reaction(emoji='🔄')
+            message_id = message.id
+            self.distribution_messages.add(message_id)
+        self.remember_digest(message_id, digest)
+
+        # Update ledger
+        await self.bot.db.execute(
+            "INSERT INTO distribution_message VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON CONFLICT (channel_id, kind, date) DO UPDATE SET "
+            "message_id=EXCLUDED.message_id, content_hash=EXCLUDED.content_hash;",
+            (channel.guild.id, channel.id, kind, date.date(), message_id, digest)
+        )
+
+    async def distribute_schedule(
+            self, channel: discord.TextChannel, course: str, date: datetime, schedule: dict, url: str
+    ):
+        """Sends timetable and homework to the schedule channel of a guild
+
+        :param channel: discord.TextChannel - Schedule channel
+        :param course: str - Course of the guild
+        :param date: datetime - Schedule date
+        :param schedule: dict - {course: [lesson1, lesson2]}
+        :param url: str - Schedule page URL
+        """
+        # Get timetable if exists
+        timetable = self.timetables.get(channel.guild.id, {})
+
+        # Schedule to description
+        lines = []
+        for index, lesson in enumerate(schedule[course]):
+            if lesson.strip():
+                try:
+                    lines.append(f"`{timetable[index + 1]} {index + 1}` {lesson.strip()}")
+                except KeyError:
+                    lines.append(f"`{index + 1}` {lesson.strip()}")
+
+        # Get homework
+        homework = await self.get_homework(guild_id=channel.guild.id, date1=date)
+
+        # Send or update message
+        embed, digest = self.render_homework(await self.date_format(date=date), homework, '\n'.join(lines), url)
+        await self.publish(channel, 'schedule', date, embed, digest)
+
+    @staticmethod
+    def poll_interval(now: datetime):
+        """Returns minutes until the next check of the schedule page
+
+        The school posts changes in the afternoon before a school day, so the page is checked often at that time
+        and rarely at night and on Saturday.
+        """
+        if now.hour >= 22 or now.hour < 7 or now.weekday() == 5:  # Night or Saturday
+            return 60
+        if 12 <= now.hour < 20:  # Posting window
+            return 3
+        return 15
+
+    def next_poll_time(self, now: datetime):
+        """Returns the time of the next check of the schedule page
+
+        Intervals change on the hour, so a check never waits past the start of a band with a shorter interval.
+        """
+        deadline = now + timedelta(minutes=self.poll_interval(now))
+        boundary = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        if boundary < deadline and self.poll_interval(boundary) < self.poll_interval(now):
+            return boundary
+        return deadline
+
+    @tasks.loop(minutes=1)
     async def schedule_distribution(self):
         """Schedule distribution
-        Sends timetable and homework for all guilds to the schedule channel.
+        Checks the schedule page and sends timetable and homework to the schedule channels of the guilds
+        whose course schedule has changed (or that haven't got the message yet).
         """
+        trigger.set('loop:schedule_distribution')
+
+        # Adaptive interval (the loop interval itself can only change from the next tick on)
+        now = datetime.now()
+        if self.next_poll and now < self.next_poll:
+            return
+        self.next_poll = self.next_poll_time(now)
+        queries = self.bot.db.trigger_queries.get('loop:schedule_distribution', 0)
+
         # Get distribution channels from DB
-        self.cursor.execute(
-            "SELECT channel_id, course_name FROM ds_channel "
+        rows = await self.bot.db.fetchall(
+            "SELECT channel_id, course_name, source_name FROM ds_channel "
             "INNER JOIN ds_guild ON ds_guild.guild_id=ds_channel.guild_id "
             "WHERE is_schedule=True;"
         )
-        result = [{'channel': self.bot.get_channel(row[0]), 'course': row[1]} for row in self.cursor.fetchall()]
+        result = [{'channel': self.bot.get_channel(row[0]), 'course': row[1], 'source': row[2]} for row in rows]
 
         # Get tomorrow date (or monday if tomorrow is weekend)
         date = datetime.today() + timedelta(days=1)
         if date.weekday() > 4:
             date += timedelta(days=7 - date.weekday())
 
-        # Get schedule data
-        schedule = await self.get_schedule(date=date)
-        if not isinstance(schedule, dict):
-            return
+        # Get schedule data (one request for each source used by the guilds)
+        sources = list({row['source'] for row in result})
+        schedules = await asyncio.gather(
+            *(self.get_schedule(date=date, source=source, revalidate=True) for source in sources),
+            return_exceptions=True
+        )
+        schedules = {source: schedule for source, schedule in zip(sources, schedules) if isinstance(schedule, dict)}
 
-        # Main loop
-        for row in result:
-            # Message create
-            embed = discord.Embed(
-                title=await self.date_format(date=date),
-                description='',
-                url=self.bot.ScheduleURL,
-                color=self.bot.ColorDefault
-            )
+        # Courses whose schedule has changed since the last tick: {(source, course)}
+        fingerprints = {
+            (source, course): hashlib.sha1('\n'.join(lessons).encode()).hexdigest()
+            for source, schedule in schedules.items() for course, lessons in schedule.items()
+        }
+        changed = {
+            key for key, fingerprint in fingerprints.items()
+            if self.schedule_fingerprints.get((date.date(), ) + key) != fingerprint
+        }
 
-            # Get timetable if exists
-            self.cursor.execute(
-                "SELECT lesson_number, time FROM timetable WHERE guild_id=%s;",
-                (row['channel'].guild.id, )
+        # Channels that haven't got the message for the date
+        rows = await self.bot.db.fetchall(
+            "SELECT channel_id FROM distribution_message WHERE kind='schedule' AND date=%s;", (date.date(), )
+        )
+        published = {row[0] for row in rows}
+
+        # Publish only where something has changed (guilds without a course or with a course missing on the page
+        # have nothing to publish)
+        dirty_guilds, self.dirty_guilds = self.dirty_guilds, set()
+        result = [
+            row for row in result
+            if row['channel'] and row['source'] in schedules and row['course'] in schedules[row['source']] and (
+                (row['source'], row['course']) in changed
+                or row['channel'].id not in published
+                or row['channel'].guild.id in dirty_guilds
             )
-            timetable = {row[0]: row[1] for row in self.cursor.fetchall()}
+        ]
 
-            # Add schedule to description
-            for index, lesson in enumerate(schedule[row['course']]):
-                if lesson.strip():
-                    try:
-                        embed.description += f"\n`{timetable[index + 1]} {index + 1}` {lesson.strip()}"
-                    except KeyError:
-                        embed.description += f"\n`{index + 1}` {lesson.strip()}"
+        # Main loop (guilds are processed concurrently, each guild sends to its own channel rate limit bucket)
+        semaphore = asyncio.Semaphore(self.distribution_concurrency)
+        timings = {}
 
-            async for message in row['channel'].history(limit=None):
+        async def distribute(row):
+            async with semaphore:
+                start = time.perf_counter()
                 try:
-                    # Avoiding existing message
-                    if "Дома" not in message.embeds[0].title and date.strftime('%d.%m.%y') in message.embeds[0].title:
-                        if '\n' + message.embeds[0].description == embed.description:
-                            break
-                        await message.delete()
-                except (TypeError, IndexError):  # Not schedule message
-                    continue
-            else:
-                # Get homework
-                homework = await self.get_homework(guild_id=row['channel'].guild.id, date1=date)
-
-                # Add homework to fields
-                for lesson, hw in homework[date.strftime('%d.%m.%y')].items():
-                    value = hw['content']
-                    if hw['files']:
-                        value += "\nПрикреплённые файлы: "
-                        for index, link in enumerate(hw['files']):
-                            value += f"[№{index + 1}]({link})"
-                            value += ', ' if index + 1 < len(hw['files']) else ''
-                    if value:
-                        embed.add_field(name=lesson, value=value, inline=False)
-                embed.url = self.bot.ScheduleURL
-
-                # Send message and add refresh button
-                message = await row['channel'].send(embed=embed)
-                await message.add_reaction(emoji='🔄')
+                    await self.distribute_schedule(
+                        row['channel'], row['course'], date, schedules[row['source']],
+                        self.schedule_sources[row['source']].url
+                    )
+                finally:
+                    timings[row['channel'].guild.id] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(distribute(row) for row in result), return_exceptions=True)
+        errors = [error for error in results if isinstance(error, Exception)]
+        for error in errors:
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+        # Remember fingerprints of the courses delivered to all their guilds (failed ones are retried next tick)
+        failed = {
+            (row['source'], row['course']) for row, error in zip(result, results) if isinstance(error, Exception)
+        }
+        self.schedule_fingerprints = {
+            key: value for key, value in self.schedule_fingerprints.items() if key[0] == date.date()
+        }
+        for key, fingerprint in fingerprints.items():
+            if key not in failed:
+                self.schedule_fingerprints[(date.date(), ) + key] = fingerprint
+        for row in result:
+            if (row['source'], row['course']) in failed:
+                self.dirty_guilds.add(row['channel'].guild.id)
+
+        # Tick summary
+        self.distribution_stats = {
+            'date': date,
+            'duration': time.perf_counter() - start,
+            'guilds': timings,
+            'errors': len(errors),
+            'round_trips': self.bot.db.trigger_queries.get('loop:schedule_distribution', 0) - queries
+        }
+        slowest = max(timings.items(), key=lambda item: item[1], default=(None, 0))
+        print(
+            f"Schedule distribution: {len(timings)} guilds in {self.distribution_stats['duration']:.2f}s, "
+            f"slowest {slowest[0]} ({slowest[1]:.2f}s), {len(errors)} errors, "
+            f"{self.distribution_stats['round_trips']} DB round trips"
+        )
 
     @tasks.loop(hours=12)
     async def weekly_homework_distribution(self):
         """Weekly homework distribution
         Sends homework for week every friday
         """
+        trigger.set('loop:weekly_homework_distribution')
+
         # Is friday check
         if datetime.today().weekday() != 4:
             return
@@ -216,8 +530,7 @@ class School(commands.Cog, name="school"):
         date2 = date1 + timedelta(days=4)
 
         # Get distribution channels from DB
-        self.cursor.execute("SELECT channel_id FROM ds_channel WHERE is_schedule=True;")
-        channel_ids = self.cursor.fetchall()
+        channel_ids = await self.bot.db.fetchall("SELECT channel_id FROM ds_channel WHERE is_schedule=True;")
         channels = [self.bot.get_channel(channel_id[0]) for channel_id in channel_ids]  # discord.Channel objects
 
         # Message title
@@ -225,37 +538,12 @@ class School(commands.Cog, name="school"):
 
         # Main loop
         for channel in channels:
-            async for message in channel.history(limit=None):
-                try:
-                    # Avoid existing message
-                    if title == message.embeds[0].title:
-                        break
-                except (TypeError, IndexError):  # Not schedule message
-                    continue
-            else:
-                # Get homework
-                homework = await self.get_homework(guild_id=channel.guild.id, date1=date1, date2=date2)
-
-                # Create message
-                embed = discord.Embed(title=title, color=self.bot.ColorDefault)
-
-                # Add homework to fields
-                for date, homework in homework.items():
-                    values = ''
-                    for lesson, hw in homework.items():
-                        value = hw['content']
-                        if hw['files']:
-                            value += "\nПрикреплённые файлы: "
-                            for index, link in enumerate(hw['files']):
-                                value += f"[№{index + 1}]({link})"
-                                value += ', ' if index + 1 < len(hw['files']) else ''
-                        if value:
-                            values += f'**{lesson}**{value}\n'
-                    embed.add_field(name=date, value=values or r'¯\_(ツ)_/¯ Ничего не задано')
-
-                # Send message and add refresh button
-                message = await channel.send(embed=embed)
-                await message.add_reaction(emoji='🔄')
+            # Get homework
+            homework = await self.get_homework(guild_id=channel.guild.id, date1=date1, date2=date2)
+
+            # Send or update message
+            embed, digest = self.render_homework(title, homework)
+            await self.publish(channel, 'weekly', date1, embed, digest)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -267,93 +555,148 @@ class School(commands.Cog, name="school"):
         self.weekly_homework_distribution.start()
 
     @commands.Cog.listener()
-    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
-        """Updates homework in reaction message
+    async def on_message(self, message: discord.Message):
+        """Adds new homework to the index (a new message can't replace indexed homework, so chat costs nothing)"""
+        if message.channel.id in self.lesson_channels and self.parse_homework(message):
+            await self.index_homework([message])
 
-        :param payload: discord.RawReactionActionEvent - The raw event payload data
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """Updates edited homework in the index
+
+        The gateway payload carries the edited message, updates without content (embeds resolved for links, etc.)
+        don't change homework and are ignored.
         """
-        # Get payload data
-        channel = self.bot.get_channel(payload.channel_id)
-        if not channel:  # Avoid DM messages
+        data = payload.data
+        if payload.channel_id not in self.lesson_channels or 'content' not in data:
             return
-        message = await channel.fetch_message(payload.message_id)
-        member = payload.member
-        reaction = payload.emoji
-
-        # Get schedule channels from DB
-        self.cursor.execute("SELECT channel_id FROM ds_channel WHERE is_schedule=True;")
-        selected = self.cursor.fetchall()
-        channels = [channel_id[0] for channel_id in selected]
 
-        # Work only with schedule channels, avoiding bot's reactions
-        if channel.id not in channels:  # Non-schedule channel
-            return
-        if member == self.bot.user:  # Bot's reaction
+        # Partial payload without attachments, read the whole message
+        if 'attachments' not in data:
+            channel = self.bot.get_channel(payload.channel_id)
+            try:
+                message = await channel.fetch_message(payload.message_id)
+            except discord.NotFound:
+                return
+            await self.index_homework([message])
             return
-        if reaction.name != '🔄':  # Another reactions
-            return await message.remove_reaction(emoji=reaction, member=member)
 
-        # Loading indicator
-        async def loading_indicator(msg: discord.Message):
-            """Refresh the loading indicator (footer) every 0.5 sec"""
-            indicator = "Loading"
-            while True:
-                indicator = indicator + '.' if indicator != "Loading..." else "Loading"
-                await msg.edit(embed=msg.embeds[0].set_footer(text=indicator))
-                await asyncio.sleep(0.5)
-        task = self.bot.loop.create_task(loading_indicator(msg=message))
+        guild_id = int(data['guild_id']) if 'guild_id' in data else self.bot.get_channel(payload.channel_id).guild.id
+        row = self.homework_row(
+            payload.message_id, guild_id, payload.channel_id, data['content'],
+            [attachment['url'] for attachment in data['attachments']],
+            f"https://discord.com/channels/{guild_id}/{payload.channel_id}/{payload.message_id}"
+        )
+        await self.store_homework([row] if row else [], [] if row else [payload.message_id])
 
-        # Main
-        if "Домашнее задание" in message.embeds[0].title:  # Weekly homework
-            embed = discord.Embed(title=message.embeds[0].title, color=self.bot.ColorDefault)
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """Removes deleted homework from the index"""
+        if payload.channel_id in self.lesson_channels:
+            await self.bot.db.execute("DELETE FROM homework WHERE message_id=%s;", (payload.message_id, ))
 
-            # Get start and end date
-            date1 = datetime.strptime(embed.title.split()[3], '%d.%m.%y')
-            date2 = datetime.strptime(embed.title.split()[5], '%d.%m.%y')
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """Removes deleted homework from the index"""
+        if payload.channel_id in self.lesson_channels:
+            await self.bot.db.execute("DELETE FROM homework WHERE message_id = ANY(%s);", (list(payload.message_ids), ))
 
-            # Get homework
-            homework = await self.get_homework(guild_id=channel.guild.id, date1=date1, date2=date2)
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        """Forgets the deleted channel"""
+        config = self.bot.guild_config.guilds.get(channel.guild.id)
+        if config and config['schedule_channel'] == channel.id:
+            self.bot.guild_config.update(channel.guild.id, schedule_channel=None)
+        self.lesson_channels.pop(channel.id, None)
 
-            # Create message
-            for date, homework in homework.items():
-                values = ''
-                for lesson, hw in homework.items():
-                    value = hw['content']
-                    if hw['files']:
-                        value += "\nПрикреплённые файлы: "
-                        for index, link in enumerate(hw['files']):
-                            value += f"[№{index + 1}]({link})"
-                            value += ', ' if index + 1 < len(hw['files']) else ''
-                    if value:
-                        values += f'**{lesson}**{value}\n'
-                embed.add_field(name=date, value=values or r'¯\_(ツ)_/¯ Ничего не задано')
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        """Forgets the channels of the removed guild"""
+        for channel in guild.channels:
+            self.lesson_channels.pop(channel.id, None)
+
+    def refresh_done(self, message_id: int, task: asyncio.Task):
+        """Forgets the finished refresh and reports its error"""
+        self.refreshes.pop(message_id, None)
+        if not task.cancelled() and task.exception():
+            error = task.exception()
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+        # Forget refresh times that no longer limit anything
+        now = time.monotonic()
+        for key in [key for key, value in self.refreshed_at.items() if now - value >= self.refresh_interval]:
+            del self.refreshed_at[key]
+
+    async def refresh_message(self, channel: discord.TextChannel, message_id: int):
+        """Updates homework in the distribution message
+
+        :param channel: discord.TextChannel - Schedule channel
+        :param message_id: int - Distribution message ID
+        """
+        message = await channel.fetch_message(message_id)
+        await channel.trigger_typing()  # Loading indicator without message edits
+
+        # Main
+        title = message.embeds[0].title
+        if "Домашнее задание" in title:  # Weekly homework
+            date1 = datetime.strptime(title.split()[3], '%d.%m.%y')
+            date2 = datetime.strptime(title.split()[5], '%d.%m.%y')
+            homework = await self.get_homework(guild_id=channel.guild.id, date1=date1, date2=date2)
+            embed, digest = self.render_homework(title, homework)
         else:  # Schedule
-            embed = discord.Embed(
-                title=message.embeds[0].title,
-                description=message.embeds[0].description,
-                url=self.bot.ScheduleURL,
-                color=self.bot.ColorDefault
+            date = datetime.strptime(title.split()[1], '%d.%m.%y')
+            homework = await self.get_homework(guild_id=channel.guild.id, date1=date)
+            embed, digest = self.render_homework(
+                title, homework, message.embeds[0].description, message.embeds[0].url or None
             )
+        self.refreshed_at[message_id] = time.monotonic()
 
-            # Date from title
-            date = datetime.strptime(embed.title.split()[1], '%d.%m.%y')
+        # Edit message if its content has changed
+        if digest == await self.posted_digest(message_id):
+            return
+        await message.edit(embed=embed)
+        self.remember_digest(message_id, digest)
 
-            # Get homework
-            homework = await self.get_homework(guild_id=channel.guild.id, date1=date)
+        # Keep ledger in sync with the message content
+        await self.bot.db.execute(
+            "UPDATE distribution_message SET content_hash=%s WHERE message_id=%s;", (digest, message_id)
+        )
 
-            # Create message
-            for lesson, hw in homework[date.strftime('%d.%m.%y')].items():
-                value = hw['content']
-                if hw['files']:
-                    value += "\nПрикреплённые файлы: "
-                    for index, link in enumerate(hw['files']):
-                        value += f"[№{index + 1}]({link})"
-                        value += ', ' if index + 1 < len(hw['files']) else ''
-                embed.add_field(name=lesson, value=value, inline=False)
-
-        # Edit message and remove reaction
-        task.cancel()  # Stop loading indicator
-        await message.edit(embed=embed)
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        """Updates homework in reaction message
+
+        :param payload: discord.RawReactionActionEvent - The raw event payload data
+        """
+        # Work only with schedule channels, avoiding bot's reactions (checked before any request)
+        if payload.guild_id is None:  # DM
+            return
+        config = await self.bot.guild_config.get(payload.guild_id)
+        if not config or payload.channel_id != config['schedule_channel']:  # Non-schedule channel
+            return
+        if payload.user_id == self.bot.user.id:  # Bot's reaction
+            return
+
+        # Get payload data
+        channel = self.bot.get_channel(payload.channel_id)
+        message = channel.get_partial_message(payload.message_id)
+        member = payload.member
+        reaction = payload.emoji
+        if reaction.name != '🔄':  # Another reactions
+            return await message.remove_reaction(emoji=reaction, member=member)
+        if message.id not in self.distribution_messages:  # Not distribution message
+            return
+
+        # Overlapping clicks share one refresh, clicks right after a refresh don't start a new one
+        task = self.refreshes.get(message.id)
+        if task is None and time.monotonic() - self.refreshed_at.get(message.id, 0) >= self.refresh_interval:
+            task = self.bot.loop.create_task(self.refresh_message(channel, message.id))
+            self.refreshes[message.id] = task
+            task.add_done_callback(lambda done: self.refresh_done(message.id, done))
+        if task is not None:
+            await asyncio.wait({task})
+
+        # Remove reaction
         await message.remove_reaction(emoji=reaction, member=member)
 
     @commands.command(
@@ -376,17 +719,16 @@ class School(commands.Cog, name="school"):
         :param course: str - Course name in format as on the school website
         """
         # Course argument
+        config = await self.bot.guild_config.get(ctx.guild.id) or {}  # Empty if the guild isn't in the database
+        guild_course, source = config.get('course_name'), config.get('source_name', 'school36')
         if course:
-            self.cursor.execute("SELECT course_name FROM course")
-            courses = [course[0] for course in self.cursor.fetchall()]
+            courses = [course[0] for course in await self.bot.db.fetchall("SELECT course_name FROM course")]
             if course not in courses:
                 raise commands.BadArgument("Incorrect course")
         else:
-            self.cursor.execute("SELECT course_name FROM ds_guild WHERE guild_id=%s", (ctx.guild.id, ))
-            course = self.cursor.fetchone()
-            if not course:
+            if not guild_course:
                 raise commands.BadArgument("**Course** not specified in this server. Use **set_course** command")
-            course = course[0]
+            course = guild_course
 
         # Date argument
         try:
@@ -397,13 +739,12 @@ class School(commands.Cog, name="school"):
             raise commands.BadArgument("**Date** should have **DD.MM.YY** format")
 
         # Get schedule
-        schedule = await self.get_schedule(date=date)
+        schedule = await self.get_schedule(date=date, source=source)
         if not isinstance(schedule, dict):
             raise commands.BadArgument(schedule.__str__())
 
         # Get timetable if exists
-        self.cursor.execute("SELECT lesson_number, time FROM timetable WHERE guild_id=%s;", (ctx.guild.id, ))
-        timetable = {row[0]: row[1] for row in self.cursor.fetchall()}
+        timetable = self.timetables.get(ctx.guild.id, {})
 
         # Create message
         title = await self.date_format(date=date) + ' ' + course
@@ -417,6 +758,75 @@ class School(commands.Cog, name="school"):
         # Send message
         await ctx.send(embed=embed)
 
+    @commands.command(
+        name="hw_search",
+        brief="Search homework by text",
+        help=(
+                "Looks for the text in all homework of this server collected from the lesson channels. "
+                "Put the text in quotes if it has several words, use '*' to skip a filter. "
+                "Results are shown by 5, to open the next pages skip the filters: `hw_search \"text\" * * * 2`"
+        ),
+        usage=[
+            ["text", "required", "Text to look for"],
+            ["lesson", "optional", "Lesson name or '*' (default: any)"],
+            ["date1", "optional", "DD.MM.YY or '*', start of the period (default: any)"],
+            ["date2", "optional", "DD.MM.YY or '*', end of the period (default: any)"],
+            ["page", "optional", "Page of results (default: 1)"]
+        ]
+    )
+    async def hw_search(
+            self, ctx, text: str, lesson: str = '*', date1: str = None, date2: str = None, page: int = 1
+    ):
+        """
+        :param ctx: discord.ext.commands.Context - Represents the context in which a command is being invoked under
+        :param text: str - Text to look for
+        :param lesson: str - Lesson name or '*' (any lesson)
+        :param date1: str - Start date in DD.MM.YY format or '*' (any)
+        :param date2: str - End date in DD.MM.YY format or '*' (any)
+        :param page: int - Page of results
+        """
+        per_page = 5
+
+        # Arguments
+        try:
+            date1 = datetime.strptime(date1, '%d.%m.%y').date() if date1 and date1 != '*' else None
+            date2 = datetime.strptime(date2, '%d.%m.%y').date() if date2 and date2 != '*' else None
+        except ValueError:
+            raise commands.BadArgument("**Date** should have **DD.MM.YY** format")
+        if page < 1:
+            raise commands.BadArgument("**Page** should be a positive number")
+        lesson = None if lesson == '*' else lesson.lower()
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        # Search (ILIKE uses the trigram index)
+        selected = await self.bot.db.fetchall(
+            "SELECT lesson_name, date, content, source, COUNT(*) OVER() FROM homework "
+            "INNER JOIN ds_channel ON ds_channel.channel_id=homework.channel_id "
+            "WHERE homework.guild_id=%s AND lesson_name IS NOT NULL AND content ILIKE %s "
+            "AND (%s::text IS NULL OR lesson_name=%s) "
+            "AND (%s::date IS NULL OR date >= %s) AND (%s::date IS NULL OR date <= %s) "
+            "ORDER BY date DESC, message_id DESC LIMIT %s OFFSET %s;",
+            (ctx.guild.id, pattern, lesson, lesson, date1, date1, date2, date2, per_page, (page - 1) * per_page)
+        )
+
+        # Create message
+        embed = discord.Embed(title=f"Homework search: {text}", color=self.bot.ColorDefault)
+        if not selected:
+            embed.description = "Nothing found"
+            return await ctx.send(embed=embed)
+        for lesson_name, date, content, source, total in selected:
+            content = content.strip()
+            content = content if len(content) <= 300 else content[:297] + '...'
+            embed.add_field(
+                name=f"{lesson_name.capitalize()} {date.strftime('%d.%m.%y')}",
+                value=f"{content}\n[Сообщение]({source})",
+                inline=False
+            )
+        embed.set_footer(text=f"Page {page}/{(selected[0][4] + per_page - 1) // per_page}")
+
+        # Send message
+        await ctx.send(embed=embed)
+
     @commands.command(
         name="set_course",
         brief="Set course name to your server",
@@ -435,14 +845,76 @@ class School(commands.Cog, name="school"):
         """
         # Update DB
         try:
-            self.cursor.execute("UPDATE ds_guild SET course_name=%s WHERE guild_id=%s;", (course, ctx.guild.id))
+            await self.bot.db.execute("UPDATE ds_guild SET course_name=%s WHERE guild_id=%s;", (course, ctx.guild.id))
         except psycopg2.errors.ForeignKeyViolation:
             raise commands.BadArgument("Name is incorrect")
+        await self.bot.guild_config.set(ctx.guild.id, course_name=course)
+        self.dirty_guilds.add(ctx.guild.id)
 
         # Send message
         embed = discord.Embed(description=f"Course of this server is set as **{course}**", color=self.bot.ColorDefault)
         await ctx.send(embed=embed)
 
+    @commands.command(
+        name="set_school",
+        brief="Set school whose schedule is used on your server",
+        help=(
+                "Bot takes the schedule from the website of the specified school. "
+                "By default it is the Murmansk secondary school №36 (**school36**)."
+        ),
+        usage=[
+            ["school", "required", "School name as in the list of available schools"]
+        ]
+    )
+    async def set_school(self, ctx, school: str):
+        """
+        :param ctx: discord.ext.commands.Context - Represents the context in which a command is being invoked under
+        :param school: str - Schedule source name
+        """
+        # Update DB
+        if school not in self.schedule_sources:
+            schools = ', '.join(f"**{name}**" for name in self.schedule_sources.sources)
+            raise commands.BadArgument(f"Unknown school\nAvailable schools: {schools}")
+        await self.bot.db.execute("UPDATE ds_guild SET source_name=%s WHERE guild_id=%s;", (school, ctx.guild.id))
+        await self.bot.guild_config.set(ctx.guild.id, source_name=school)
+        self.dirty_guilds.add(ctx.guild.id)
+
+        # Send message
+        embed = discord.Embed(description=f"School of this server is set as **{school}**", color=self.bot.ColorDefault)
+        await ctx.send(embed=embed)
+
+    @commands.command(
+        name="add_school",
+        brief="Add or change a schedule source",
+        help="Registers the school website from which the schedule can be taken",
+        usage=[
+            ["school", "required", "School name"],
+            ["url", "required", "Schedule page URL"],
+            ["parser", "required", "Page layout (e.g. 'school36')"]
+        ],
+        hidden=True
+    )
+    @commands.is_owner()
+    async def add_school(self, ctx, school: str, url: str, parser: str):
+        """
+        :param ctx: discord.ext.commands.Context - Represents the context in which a command is being invoked under
+        :param school: str - Schedule source name
+        :param url: str - Schedule page URL
+        :param parser: str - Page layout name
+        """
+        if parser not in PARSERS:
+            raise commands.BadArgument(f"Unknown parser\nAvailable parsers: {', '.join(PARSERS)}")
+        await self.bot.db.execute(
+            "INSERT INTO schedule_source VALUES (%s, %s, %s) "
+            "ON CONFLICT (source_name) DO UPDATE SET url=EXCLUDED.url, parser=EXCLUDED.parser;",
+            (school, url, parser)
+        )
+        self.schedule_sources.register(school, url, parser)
+
+        # Send message
+        embed = discord.Embed(description=f"School **{school}** is available", color=self.bot.ColorDefault)
+        await ctx.send(embed=embed)
+
     @commands.command(
         name="toggle_schedule",
         brief="Set channel to which schedule'll be sent",
@@ -461,19 +933,24 @@ class School(commands.Cog, name="school"):
         :param channel: discord.TextChannel - Channel mention or ID
         """
         # Get channel ID or None
-        self.cursor.execute("SELECT channel_id FROM ds_channel WHERE is_schedule AND guild_id=%s;", (channel.guild.id, ))
-        current_id = self.cursor.fetchone()
+        config = await self.bot.guild_config.get(channel.guild.id)
+        current_id = config['schedule_channel'] if config else None
 
         # Change state
         message = f"Now the schedule will be sent to {channel.mention}"
         if not current_id:  # First setup
-            self.cursor.execute("UPDATE ds_channel SET is_schedule=True WHERE channel_id=%s;", (channel.id, ))
-        elif current_id[0] != channel.id:  # Change channel
-            self.cursor.execute("UPDATE ds_channel SET is_schedule=False WHERE channel_id=%s;", (current_id[0], ))
-            self.cursor.execute("UPDATE ds_channel SET is_schedule=True WHERE channel_id=%s;", (channel.id, ))
+            await self.bot.db.execute("UPDATE ds_channel SET is_schedule=True WHERE channel_id=%s;", (channel.id, ))
+            await self.bot.guild_config.set(channel.guild.id, schedule_channel=channel.id)
+        elif current_id != channel.id:  # Change channel
+            await self.bot.db.execute(
+                "UPDATE ds_channel SET is_schedule=(channel_id=%s) WHERE channel_id IN (%s, %s);",
+                (channel.id, channel.id, current_id)
+            )
+            await self.bot.guild_config.set(channel.guild.id, schedule_channel=channel.id)
         else:  # Delete distribution
             message = "Now the schedule will not be sent"
-            self.cursor.execute("UPDATE ds_channel SET is_schedule=False WHERE channel_id=%s;", (channel.id, ))
+            await self.bot.db.execute("UPDATE ds_channel SET is_schedule=False WHERE channel_id=%s;", (channel.id, ))
+            await self.bot.guild_config.set(channel.guild.id, schedule_channel=None)
 
         # Send message
         embed = discord.Embed(description=message, color=self.bot.ColorDefault)
@@ -487,7 +964,7 @@ class School(commands.Cog, name="school"):
                 "The task message must have this format:"
                 "```\nдз {день недели} {дата в формате ДД.ММ.ГГ}"
                 "\nТекст сообщения```"
-                "You can also attach files."
+                "You can also attach files. Use **index_homework** to collect the tasks written before."
         ),
         usage=[
             ["channel", "required", "Channel mention (use '#channel-name' or ID)"],
@@ -504,9 +981,10 @@ class School(commands.Cog, name="school"):
         lesson = lesson.lower()
         message = f"Now I will look for **{lesson}** homework In the **{channel.mention}**"
         try:
-            self.cursor.execute("UPDATE ds_channel SET lesson_name=%s WHERE channel_id=%s;", (lesson, channel.id))
+            await self.bot.db.execute("UPDATE ds_channel SET lesson_name=%s WHERE channel_id=%s;", (lesson, channel.id))
         except psycopg2.errors.ForeignKeyViolation:
             raise commands.BadArgument("Name is incorrect\nFind out the list of available lessons using `get_lessons`")
+        self.lesson_channels[channel.id] = lesson
 
         # Send message
         embed = discord.Embed(description=message, color=self.bot.ColorDefault)
@@ -528,11 +1006,41 @@ class School(commands.Cog, name="school"):
         :param ctx: discord.ext.commands.Context - Represents the context in which a command is being invoked under
         :param channel: discord.TextChannel - Channel mention or ID
         """
-        self.cursor.execute("UPDATE ds_channel SET lesson_name=NULL WHERE channel_id=%s;", (channel.id, ))
+        await self.bot.db.execute(
+            "UPDATE ds_channel SET lesson_name=NULL WHERE channel_id=%s; DELETE FROM homework WHERE channel_id=%s;",
+            (channel.id, channel.id)
+        )
+        self.lesson_channels.pop(channel.id, None)
         message = f"Now the **{channel.mention}** is not related to homework"
         embed = discord.Embed(description=message, color=self.bot.ColorDefault)
         await ctx.send(embed=embed)
 
+    @commands.command(
+        name="index_homework",
+        brief="Collect the homework already written in the lesson channels",
+        help=(
+                "Reads the whole history of the lesson channels of this server and remembers all homework. "
+                "New messages are remembered automatically, so the command is needed only once "
+                "after the lesson channels are set."
+        ),
+        usage=[]
+    )
+    @commands.has_permissions(administrator=True)
+    async def index_homework_command(self, ctx):
+        """
+        :param ctx: discord.ext.commands.Context - Represents the context in which a command is being invoked under
+        """
+        total = 0
+        for channel in ctx.guild.text_channels:
+            if channel.id not in self.lesson_channels:
+                continue
+            messages = [message async for message in channel.history(limit=None)]
+            total += await self.index_homework(messages)
+
+        # Send message
+        embed = discord.Embed(description=f"**{total}** homework messages collected", color=self.bot.ColorDefault)
+        await ctx.send(embed=embed)
+
     @commands.command(
         name="get_lessons",
         brief="Send a list of all available lessons",
@@ -543,8 +1051,7 @@ class School(commands.Cog, name="school"):
         usage=[]
     )
     async def get_lessons(self, ctx):
-        self.cursor.execute("SELECT lesson_name FROM lesson;")
-        lessons = [lesson[0].capitalize() for lesson in self.cursor.fetchall()]
+        lessons = [lesson[0].capitalize() for lesson in await self.bot.db.fetchall("SELECT lesson_name FROM lesson;")]
         embed = discord.Embed(title="Available lessons", description='\n'.join(lessons), color=self.bot.ColorDefault)
         await ctx.send(embed=embed)
 
@@ -564,7 +1071,9 @@ class School(commands.Cog, name="school"):
     )
     async def set_timetable(self, ctx, *timetable):
         # Delete old data
-        self.cursor.execute("DELETE FROM timetable WHERE guild_id=%s;", (ctx.guild.id, ))
+        await self.bot.db.execute("DELETE FROM timetable WHERE guild_id=%s;", (ctx.guild.id, ))
+        self.timetables[ctx.guild.id] = {}
+        self.dirty_guilds.add(ctx.guild.id)
 
         # If argument is not empty
         if timetable:
@@ -575,14 +1084,16 @@ class School(commands.Cog, name="school"):
                 color=self.bot.ColorDefault
             )
             for index, time in enumerate(timetable):
-                # Insert new data
-                self.cursor.execute(
-                    "INSERT INTO timetable VALUES (%s, %s, %s);",
-                    (ctx.guild.id, index+1, time)
-                )
+                self.timetables[ctx.guild.id][index+1] = time
 
                 # Add content in message
                 embed.description += f"\n`{time} {index+1}` Some lesson"
+
+            # Insert new data
+            await self.bot.db.execute_values(
+                "INSERT INTO timetable VALUES %s;",
+                [(ctx.guild.id, index+1, time) for index, time in enumerate(timetable)]
+            )
         else:
             # Create message about data delete
             embed = discord.Embed(description="Old timetable has been deleted", color=self.bot.ColorDefault)
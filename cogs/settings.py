@@ -2,9 +2,7 @@
 
 import discord
 from discord.ext import commands
-import psycopg2
-from urllib.parse import urlparse
-import os
+from datetime import datetime
 
 
 class Settings(commands.Cog, name="settings"):
@@ -12,18 +10,6 @@ class Settings(commands.Cog, name="settings"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-        # Postgres connection
-        result = urlparse(os.environ['DATABASE_URL'])
-        with psycopg2.connect(
-                dbname=result.path[1:],
-                user=result.username,
-                password=result.password,
-                host=result.hostname,
-                port=result.port
-        ) as connection:
-            connection.autocommit = True
-            self.cursor = connection.cursor()
-
     @commands.command(
         name="toggle_greetings",
         brief="Turns on/off notification system for member join/remove in the system channel",
@@ -33,9 +19,11 @@ class Settings(commands.Cog, name="settings"):
     @commands.has_permissions(administrator=True)
     async def toggle_greetings(self, ctx):
         # Update database
-        self.cursor.execute("SELECT is_greetings FROM ds_guild WHERE guild_id=%s;", (ctx.guild.id,))
-        is_greetings = not self.cursor.fetchone()[0]
-        self.cursor.execute("UPDATE ds_guild SET is_greetings=%s WHERE guild_id=%s;", (is_greetings, ctx.guild.id))
+        is_greetings, = await self.bot.db.fetchone(
+            "UPDATE ds_guild SET is_greetings=NOT is_greetings WHERE guild_id=%s RETURNING is_greetings;",
+            (ctx.guild.id,)
+        )
+        await self.bot.guild_config.set(ctx.guild.id, is_greetings=is_greetings)
 
         # Send message
         answer = '' if is_greetings else '**not**'
@@ -44,6 +32,149 @@ class Settings(commands.Cog, name="settings"):
             embed.set_footer(text="Set the system channel in the server settings so that I can do it")
         await ctx.send(embed=embed)
 
+    @commands.command(
+        name="http_stats",
+        brief="Show outbound HTTP stats by host",
+        help="Shows the number of requests, errors, retries, traffic and latency for each host the bot has requested",
+        usage=[],
+        hidden=True
+    )
+    @commands.is_owner()
+    async def http_stats(self, ctx):
+        embed = discord.Embed(title="HTTP stats", color=self.bot.ColorDefault)
+        for host, stats in self.bot.web.stats.items():
+            embed.add_field(
+                name=host,
+                value=(
+                    f"Requests: **{stats.requests}** (errors: {stats.errors}, retries: {stats.retries})\n"
+                    f"Traffic: **{stats.bytes / 1024:.1f}** KiB\n"
+                    f"Latency: **{stats.average_latency * 1000:.0f}** ms avg, {stats.last_latency * 1000:.0f} ms last"
+                ),
+                inline=False
+            )
+        if not embed.fields:
+            embed.description = "No requests yet"
+        await ctx.send(embed=embed)
+
+    @commands.command(
+        name="queue_stats",
+        brief="Show database write queue stats",
+        help="Shows the depth of the write-behind queue of data events, the latency of its flushes and running ingests",
+        usage=[],
+        hidden=True
+    )
+    @commands.is_owner()
+    async def queue_stats(self, ctx):
+        queue = self.bot.get_cog('DataEvents').queue
+        average = queue.flush_latency / queue.flushes if queue.flushes else 0
+        embed = discord.Embed(title="Write queue stats", color=self.bot.ColorDefault)
+        embed.description = (
+            f"Depth: **{queue.depth}** (max {queue.max_depth}, limit {queue.max_size})\n"
+            f"Statements: **{queue.enqueued}** enqueued, {queue.coalesced} coalesced, {queue.flushed} flushed\n"
+            f"Flushes: **{queue.flushes}** ({queue.errors} failed), {queue.dropped} statements dropped\n"
+            f"Flush latency: **{average * 1000:.0f}** ms avg, {queue.last_flush_latency * 1000:.0f} ms last"
+        )
+
+        # Running bulk ingests of joined guilds
+        data_events = self.bot.get_cog('DataEvents')
+        for guild_id, progress in list(data_events.ingest_progress.items()):
+            embed.add_field(name=f"Ingest of {guild_id}", value=data_events.progress_text(progress), inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(
+        name="pool_stats",
+        brief="Show database pool stats",
+        help="Shows the utilisation of the shared database connection pool and the number of executed statements",
+        usage=[],
+        hidden=True
+    )
+    @commands.is_owner()
+    async def pool_stats(self, ctx):
+        db = self.bot.db
+        average_wait = db.wait_time / db.calls if db.calls else 0
+        average_busy = db.busy_time / db.calls if db.calls else 0
+        embed = discord.Embed(title="Database pool stats", color=self.bot.ColorDefault)
+        embed.description = (
+            f"Connections in use: **{db.in_use}** (peak {db.peak_in_use}, limit {db.maxconn})\n"
+            f"Waiting calls: **{db.waiting}**, {average_wait * 1000:.1f} ms avg wait\n"
+            f"Calls: **{db.calls}** ({db.errors} failed, {db.reconnects} reconnects), "
+            f"{average_busy * 1000:.1f} ms avg\n"
+            f"Statements: **{db.queries}** ({len(db.statements)} prepared)"
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(
+        name="config_stats",
+        brief="Show guild settings cache stats",
+        help="Shows the size of the guild settings cache, its hits and misses and the received notifications",
+        usage=[],
+        hidden=True
+    )
+    @commands.is_owner()
+    async def config_stats(self, ctx):
+        config = self.bot.guild_config
+        lookups = config.hits + config.misses
+        embed = discord.Embed(title="Guild settings cache stats", color=self.bot.ColorDefault)
+        embed.description = (
+            f"Guilds: **{len(config.guilds)}**\n"
+            f"Lookups: **{lookups}** ({config.hits} hits, {config.misses} misses, "
+            f"{config.hits / lookups * 100 if lookups else 0:.1f}% hit rate)\n"
+            f"Notifications: **{config.notifications}** (listener {'up' if config.listener else 'down'})"
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(
+        name="db_stats",
+        brief="Show database statement profile",
+        help=(
+                "Shows the statements with the largest total time, the time spent by each cog and the latest slow "
+                "statements with the events or commands that have sent them. Use 'reset' to start over."
+        ),
+        usage=[
+            ["reset", "optional", "'reset' to forget collected timings"]
+        ],
+        hidden=True
+    )
+    @commands.is_owner()
+    async def db_stats(self, ctx, reset: str = None):
+        profiler = self.bot.db.profiler
+        if reset == "reset":
+            profiler.reset()
+            embed = discord.Embed(description="Database timings have been reset", color=self.bot.ColorDefault)
+            return await ctx.send(embed=embed)
+
+        def timings(stats):
+            return (
+                f"**{stats.count}** × {stats.total / stats.count * 1000:.1f} ms = {stats.total:.2f}s, "
+                f"p50 {stats.percentile(0.5) * 1000:.1f} / p95 {stats.percentile(0.95) * 1000:.1f} / "
+                f"p99 {stats.percentile(0.99) * 1000:.1f} ms"
+            )
+
+        embed = discord.Embed(title="Database stats", color=self.bot.ColorDefault)
+        embed.description = '\n'.join(
+            f"`{cog}` {timings(stats)}"
+            for cog, stats in sorted(profiler.cogs.items(), key=lambda item: item[1].total, reverse=True)
+        ) or "No statements yet"
+
+        # Top statements by total time
+        top = sorted(profiler.statements.items(), key=lambda item: item[1].total, reverse=True)[:10]
+        for statement, stats in top:
+            name = statement if len(statement) <= 250 else statement[:247] + '...'
+            embed.add_field(name=name, value=timings(stats), inline=False)
+
+        # Latest slow statements
+        if profiler.slow:
+            embed.add_field(
+                name=f"Slow statements (≥ {profiler.slow_threshold * 1000:.0f} ms)",
+                value='\n'.join(
+                    f"{datetime.fromtimestamp(at).strftime('%d.%m %H:%M:%S')} **{duration * 1000:.0f}** ms "
+                    f"`{cause or '-'}` `{caller}` {statement[:60]}"
+                    for at, duration, caller, cause, statement in list(profiler.slow)[-5:]
+                ),
+                inline=False
+            )
+        await ctx.send(embed=embed)
+
 
 def setup(bot):
     bot.add_cog(Settings(bot))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Parsers of the university pages with lists of applicants
+
+Module-level functions of plain strings, so they can run in worker processes: arguments and results are pickled,
+results are tuples of str (no references to the parsed tree).
+"""
+
+from itertools import islice
+import bs4
+from bs4 import BeautifulSoup
+
+SPBU_CONDITIONS = {
+    'Без ВИ': 'БВИ',
+    'По результатам ВИ': 'ОК'
+}
+
+
+def nth_element(element, n: int):
+    """Returns the n-th element after the element in document order (None if the document ends before it)
+
+    Only n elements are walked, unlike list(element.next_elements)[n] that copies the rest of the document.
+    """
+    return next(islice(element.next_elements, n, None), None)
+
+
+def parse_spbu_specialties(html: str, main_url: str):
+    """Returns specialties from the SPbU page of lists
+
+    Each <h3> is followed by the profile, the form of study and the list links at fixed distances,
+    so every entry costs a bounded lookahead and the whole page is indexed in linear time.
+
+    :param html: str - Page of lists
+    :param main_url: str - Site URL the list links are relative to
+    :return: list of tuples - [(code, specialty with profile, form of study, budget applicants table link or None)]
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    table_of_specialties = []
+    for h3 in soup.find_all('h3'):
+        specialty = h3.next_element
+        profile = nth_element(specialty, 2) if specialty is not None else None
+        if profile is None:
+            continue
+        form = nth_element(profile, 2)
+        link = nth_element(profile, 6)
+        if form is None or link is None:
+            continue
+        form = form.get_text().split(':', 1)[-1].strip()  # "Форма обучения: очная"
+        list_link = main_url + link.attrs['href'] if link.get_text() == "Госбюджетная" else None
+        table_of_specialties.append((str(specialty[:8]), str(specialty + ' ' + profile), form, list_link))
+    return table_of_specialties
+
+
+def parse_spbu_applicants(html: str):
+    """Returns applicants from the SPbU specialty page
+
+    :param html: str - Specialty page
+    :return: list of tuples - Table rows
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    applicants = []
+    for tr in soup.tbody.find_all('tr'):
+        tds = [td.get_text() for td in tr.find_all('td')]
+        exams = [x.strip().replace(',', '.') if x.strip() else '0' for x in tds[4:6] + [tds[9]] + tds[6:9]]
+        conditions = SPBU_CONDITIONS[tds[2]]
+        applicants.append(tuple(tds[:2] + [tds[3]] + [conditions] + exams + [tds[10]] + ['-'] + tds[11:13]))
+    return applicants
+
+
+def parse_spbetu_specialties(html: str, main_url: str):
+    """Returns specialties from the ETU page of lists
+
+    :param html: str - Page of lists
+    :param main_url: str - Site URL the list links are relative to
+    :return: list of tuples - [(code, specialty, applicants table link or 'N/A')]
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    table_of_specialties = []
+    table_body = soup.find(class_='table table-bordered').tbody
+    for td in table_body:
+        if not isinstance(td, bs4.element.Tag):
+            continue
+
+        row = td.find_all('td')
+
+        code = row[0].get_text()
+        specialty = row[1].get_text().replace('\t', '').replace('\r', '').replace('\n', '')
+        try:
+            applicants_table_link = main_url + row[2].contents[0].attrs['href']
+        except AttributeError:
+            applicants_table_link = 'N/A'
+
+        table_of_specialties.append((code, specialty, applicants_table_link))
+    return table_of_specialties
+
+
+def parse_spbetu_applicants(html: str):
+    """Returns applicants from the ETU specialty page
+
+    :param html: str - Specialty page
+    :return: list of tuples - Table rows
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    applicants = []
+    for tr in soup.tbody.find_all('tr'):
+        tds = [td.get_text().replace('\n', '') for td in tr.find_all('td')]
+        applicants.append(tuple(tds[:6] + [tds[9]] + tds[6:9] + [tds[12]] + [tds[10]] + ['-', '-']))
+    return applicants
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
+
+
+def process_tree_rss(pid: int):
+    """Returns resident memory of the process and all its descendants in bytes (reads /proc, 0 if unavailable)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                stat = file.read()
+        except OSError:
+            continue
+        parent = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack += children.get(current, [])
+        try:
+            with open(f'/proc/{current}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class Browser:
+    """Headless Chrome kept between calls
+
+    All calls run in one dedicated thread (a driver must not be used from several threads at once), so the event loop
+    never waits for page loads. The driver is started on first use and restarted on the next call after an error.
+    """
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='browser')
+        self.driver = None
+
+        # Stats
+        self.starts = 0
+        self.calls = 0
+        self.errors = 0
+        self.busy_time = 0.0  # Total seconds
+        self.last_call_time = 0.0
+        self.start_time = 0.0  # Seconds of the last driver start
+
+    def start(self):
+        """Starts Chrome (runs in the browser thread)"""
+        options = webdriver.ChromeOptions()
+        options.binary_location = os.environ['GOOGLE_CHROME_BIN']
+        options.add_argument("window-size=1920x1080")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--headless")
+
+        start = time.perf_counter()
+        self.driver = webdriver.Chrome(service=Service(os.environ['CHROMEDRIVER_PATH']), options=options)
+        self.start_time = time.perf_counter() - start
+        self.starts += 1
+
+    def quit(self):
+        """Stops Chrome (runs in the browser thread)"""
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+
+    def call(self, function, *args):
+        """Calls function(driver, *args) with a running driver (runs in the browser thread)"""
+        if self.driver is None:
+            self.start()
+        start = time.perf_counter()
+        try:
+            return function(self.driver, *args)
+        except WebDriverException:
+            self.errors += 1
+            self.quit()  # The next call starts a new browser
+            raise
+        finally:
+            self.calls += 1
+            self.last_call_time = time.perf_counter() - start
+            self.busy_time += self.last_call_time
+
+    async def run(self, function, *args):
+        """Calls function(driver, *args) in the browser thread and returns its result"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.call, function, *args)
+
+    def memory(self):
+        """Returns resident memory of chromedriver and the browser processes in bytes (0 if not running)"""
+        driver = self.driver
+        if driver is None:
+            return 0
+        try:
+            return process_tree_rss(driver.service.process.pid)
+        except (AttributeError, OSError):
+            return 0
+
+    async def close(self):
+        """Stops Chrome and the browser thread"""
+        await asyncio.get_event_loop().run_in_executor(self.executor, self.quit)
+        self.executor.shutdown(wait=False)
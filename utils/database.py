@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from utils.profiler import QueryProfiler, origin, trigger
+
+
+def connection_params():
+    """Returns connection parameters from DATABASE_URL"""
+    result = urlparse(os.environ['DATABASE_URL'])
+    return {
+        'dbname': result.path[1:],
+        'user': result.username,
+        'password': result.password,
+        'host': result.hostname,
+        'port': result.port
+    }
+
+
+def connect(**params):
+    """Returns a new connection to the database from DATABASE_URL (outside of the pool)
+
+    :param params: Additional connection parameters (e.g. connect_timeout)
+    """
+    return psycopg2.connect(**connection_params(), **params)
+
+
+class Connection(psycopg2.extensions.connection):
+    """Pool connection that remembers its prepared statements"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class PreparedStatement:
+    """Statement prepared on each pool connection on first use"""
+    def __init__(self, name: str, query: str):
+        """
+        :param name: str - Statement name
+        :param query: str - Statement with $1, $2... parameters
+        """
+        self.name = name
+        self.query = query.rstrip().rstrip(';')
+        count = max((int(number) for number in re.findall(r'\$(\d+)', query)), default=0)
+        self.execute_query = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * count)});" if count else ";")
+
+
+class Database:
+    """Shared PostgreSQL access layer
+
+    Keeps a pool of connections and runs statements in a thread pool, so the event loop never waits for the database.
+    Every call is one transaction. A call that finds its connection broken gets a new connection and is retried once.
+    """
+    def __init__(self, minconn: int = 1, maxconn: int = 8):
+        """
+        :param minconn: int - Connections opened at start
+        :param maxconn: int - Maximum number of connections (and of concurrent calls)
+        """
+        self.maxconn = maxconn
+        self.pool = ThreadedConnectionPool(minconn, maxconn, connection_factory=Connection, **connection_params())
+        self.executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix='database')
+        self.statements = {}  # {name: PreparedStatement}
+        self.local = threading.local()  # Caller and trigger of the current call in each database thread
+        self.profiler = QueryProfiler(slow_threshold=float(os.environ.get('SLOW_QUERY_MS', 200)) / 1000)
+
+        # Stats
+        self.queries = 0
+        self.trigger_queries = {}  # {trigger: statements}, see utils.profiler.trigger
+        self.calls = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.waiting = 0  # Calls waiting for a free connection
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_time = 0.0  # Total seconds
+        self.busy_time = 0.0  # Total seconds
+
+    def prepare(self, name: str, query: str):
+        """Registers a hot statement
+
+        :param name: str - Statement name
+        :param query: str - Statement with $1, $2... parameters
+        :return: PreparedStatement - Pass it instead of the query to execute, fetchone or fetchall
+        """
+        self.statements[name] = PreparedStatement(name, query)
+        return self.statements[name]
+
+    @contextmanager
+    def measure(self, query: str, statements: int = 1):
+        """Counts and profiles the statements sent to the database inside the block
+
+        :param query: str - Statement (with placeholders)
+        :param statements: int - Number of round trips
+        """
+        cause = getattr(self.local, 'trigger', None)
+        self.queries += statements
+        self.trigger_queries[cause] = self.trigger_queries.get(cause, 0) + statements
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            caller = getattr(self.local, 'caller', None) or origin()
+            self.profiler.record(query, time.perf_counter() - start, caller, cause)
+
+    def query(self, cursor, query, params=None):
+        """Executes the statement on the cursor (prepares it first if needed)
+
+        :param cursor: psycopg2.extensions.cursor - Cursor of a pool connection
+        :param query: str or PreparedStatement - Statement
+        :param params: tuple or dict - Statement parameters
+        """
+        if isinstance(query, PreparedStatement):
+            with self.measure(query.query):
+                if query.name not in cursor.connection.prepared:
+                    cursor.execute(f"PREPARE {query.name} AS {query.query};")
+                    cursor.connection.prepared.add(query.name)
+                cursor.execute(query.execute_query, params)
+        else:
+            with self.measure(query):
+                cursor.execute(query, params)
+
+    def run_blocking(self, function, *args):
+        """Calls function(connection, *args) in a transaction on a pool connection and returns its result
+
+        Blocks the calling thread, so in the event loop use run instead.
+        """
+        for attempt in range(2):
+            connection = self.pool.getconn()
+            broken = connection.closed != 0
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            start = time.perf_counter()
+            try:
+                if broken:
+                    raise psycopg2.InterfaceError("connection already closed")
+                with connection:  # Commits on success, rolls back on error
+                    return function(connection, *args)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+                # Only a lost connection is retried, other operational errors (statement timeout, lock not available,
+                # missing file...) leave the connection usable and retrying could repeat non-idempotent writes
+                broken = connection.closed != 0 or isinstance(error, psycopg2.InterfaceError)
+                self.errors += 1
+                if attempt or not broken:
+                    raise
+                self.reconnects += 1
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_use -= 1
+                self.calls += 1
+                self.busy_time += time.perf_counter() - start
+                self.pool.putconn(connection, close=broken)
+
+    async def run(self, function, *args):
+        """Calls function(connection, *args) in a transaction on a pool connection off the event loop
+
+        :return: Result of the function
+        """
+        queued = time.perf_counter()
+        self.waiting += 1
+        caller, cause = origin(), trigger.get()  # Context variables don't reach the executor threads
+
+        def call():
+            self.waiting -= 1
+            self.wait_time += time.perf_counter() - queued
+            self.local.caller, self.local.trigger = caller, cause
+            try:
+                return self.run_blocking(function, *args)
+            finally:
+                self.local.caller, self.local.trigger = None, None
+
+        return await asyncio.get_event_loop().run_in_executor(self.executor, call)
+
+    def _execute(self, connection, query, params, fetch):
+        with connection.cursor() as cursor:
+            self.query(cursor, query, params)
+            if fetch == 'one':
+                return cursor.fetchone()
+            if fetch == 'all':
+                return cursor.fetchall()
+            return cursor.rowcount
+
+    async def execute(self, query, params=None):
+        """Executes the statement
+
+        :param query: str or PreparedStatement - Statement
+        :param params: tuple or dict - Statement parameters
+        :return: int - Number of affected rows
+        """
+        return await self.run(self._execute, query, params, None)
+
+    async def fetchone(self, query, params=None):
+        """Executes the statement and returns the first row (None if there are no rows)"""
+        return await self.run(self._execute, query, params, 'one')
+
+    async def fetchall(self, query, params=None):
+        """Executes the statement and returns all rows"""
+        return await self.run(self._execute, query, params, 'all')
+
+    def _execute_values(self, connection, query, rows, template):
+        with connection.cursor() as cursor, self.measure(query, (len(rows) + 999) // 1000):
+            execute_values(cursor, query, rows, template=template, page_size=1000)
+
+    async def execute_values(self, query: str, rows: list, template: str = None):
+        """Executes the multi-row statement with VALUES %s in pages of 1000 rows
+
+        :param query: str - Statement
+        :param rows: list of tuples - Rows
+        :param template: str - Row template
+        """
+        await self.run(self._execute_values, query, rows, template)
+
+    async def close(self):
+        """Closes all connections"""
+        self.executor.shutdown(wait=True)
+        self.pool.closeall()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import traceback
+import psycopg2
+import psycopg2.extensions
+from utils.database import connect
+
+
+class GuildConfig:
+    """Cache of per-guild settings
+
+    Settings of all guilds are loaded in one query, lookups are dictionary reads. A process that changes settings
+    sends NOTIFY with the guild ID, every process (including the sender) reloads that guild on the notification,
+    so the cache stays coherent when several processes share the database.
+    """
+    CHANNEL = 'guild_config'
+    QUERY = (
+        "SELECT ds_guild.guild_id, is_greetings, course_name, source_name, channel_id FROM ds_guild "
+        "LEFT JOIN ds_channel ON ds_channel.guild_id=ds_guild.guild_id AND is_schedule"
+    )
+
+    def __init__(self, db, loop: asyncio.AbstractEventLoop, reconnect_delay: float = 5, connect_timeout: int = 10):
+        """
+        :param db: utils.database.Database - Database
+        :param loop: asyncio.AbstractEventLoop - Loop that receives notifications
+        :param reconnect_delay: float - Seconds before the listener reconnects after a dropped connection
+        :param connect_timeout: int - Seconds to wait for the listener connection
+        """
+        self.db = db
+        self.loop = loop
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self.guilds = {}  # {guild_id: {is_greetings, course_name, source_name, schedule_channel}}
+        self.listener = None
+        self.listener_fd = None
+        self.closed = False
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.notifications = 0
+
+    @staticmethod
+    def row_config(row):
+        """Returns the settings of the ds_guild row"""
+        return {'is_greetings': row[1], 'course_name': row[2], 'source_name': row[3], 'schedule_channel': row[4]}
+
+    def load_blocking(self):
+        """Loads the settings of all guilds (blocks the calling thread, used at startup)"""
+        def fetch(connection):
+            with connection.cursor() as cursor:
+                self.db.query(cursor, self.QUERY + ';')
+                return cursor.fetchall()
+
+        rows = self.db.run_blocking(fetch)
+        self.guilds = {row[0]: self.row_config(row) for row in rows}
+
+    async def load(self):
+        """Loads the settings of all guilds"""
+        rows = await self.db.fetchall(self.QUERY + ';')
+        self.guilds = {row[0]: self.row_config(row) for row in rows}
+
+    async def reload(self, guild_id: int):
+        """Loads the settings of the guild
+
+        :return: dict - Settings of the guild (None if the guild isn't in the database)
+        """
+        row = await self.db.fetchone(self.QUERY + " WHERE ds_guild.guild_id=%s;", (guild_id, ))
+        if row is None:
+            self.guilds.pop(guild_id, None)
+            return None
+        self.guilds[guild_id] = self.row_config(row)
+        return self.guilds[guild_id]
+
+    async def get(self, guild_id: int):
+        """Returns the settings of the guild (None if the guild isn't in the database)
+
+        :param guild_id: int - Guild's ID
+        :return: dict - {is_greetings, course_name, source_name, schedule_channel}
+        """
+        config = self.guilds.get(guild_id)
+        if config is not None:
+            self.hits += 1
+            return config
+        self.misses += 1
+        return await self.reload(guild_id)
+
+    def update(self, guild_id: int, **values):
+        """Changes the cached settings of the guild in this process only"""
+        if guild_id in self.guilds:
+            self.guilds[guild_id].update(values)
+
+    def forget(self, guild_id: int):
+        """Removes the guild from the cache of this process"""
+        self.guilds.pop(guild_id, None)
+
+    async def set(self, guild_id: int, **values):
+        """Changes the cached settings of the guild and tells other processes to reload it
+
+        Call it after the new settings are written to the database.
+        """
+        self.update(guild_id, **values)
+        await self.db.execute("SELECT pg_notify(%s, %s);", (self.CHANNEL, str(guild_id)))
+
+    def connect_listener(self):
+        """Returns a new connection subscribed to the notifications (blocking, runs in a database thread)"""
+        connection = connect(connect_timeout=self.connect_timeout)
+        try:
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.CHANNEL};")
+        except psycopg2.Error:
+            connection.close()
+            raise
+        return connection
+
+    def attach(self, connection):
+        """Starts reading notifications of the listener connection in the loop"""
+        self.listener = connection
+        self.listener_fd = connection.fileno()
+        self.loop.add_reader(self.listener_fd, self.on_notify)
+
+    def listen(self):
+        """Subscribes to the notifications of other processes (blocking, used at startup)"""
+        self.attach(self.connect_listener())
+
+    def on_notify(self):
+        """Reloads the guilds whose settings have changed (called by the loop when the listener is readable)"""
+        try:
+            self.listener.poll()
+        except psycopg2.Error as error:
+            traceback.print_exception(type(error), error, error.__traceback__)
+            self.detach()
+            self.schedule_reconnect()
+            return
+        while self.listener.notifies:
+            notify = self.listener.notifies.pop(0)
+            self.notifications += 1
+            self.loop.create_task(self.reload(int(notify.payload)))
+
+    def schedule_reconnect(self):
+        """Reconnects the listener after reconnect_delay seconds"""
+        self.loop.call_later(self.reconnect_delay, lambda: self.loop.create_task(self.reconnect()))
+
+    async def reconnect(self):
+        """Listens again and reloads everything (notifications sent meanwhile are lost)
+
+        The connection is opened in a database thread, so an unreachable server doesn't block the loop.
+        """
+        if self.closed:
+            return
+        try:
+            connection = await self.loop.run_in_executor(self.db.executor, self.connect_listener)
+        except psycopg2.Error:
+            self.schedule_reconnect()
+            return
+        if self.closed:
+            connection.close()
+            return
+        self.attach(connection)
+        await self.load()
+
+    def detach(self):
+        """Stops reading notifications and closes the listener connection"""
+        if self.listener is not None:
+            self.loop.remove_reader(self.listener_fd)
+            self.listener.close()
+            self.listener = None
+
+    def close(self):
+        """Unsubscribes from notifications"""
+        self.closed = True
+        self.detach()
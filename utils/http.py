@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from urllib.parse import urlparse
+import aiohttp
+from multidict import CIMultiDict
+
+
+class Response:
+    """Downloaded HTTP response"""
+    def __init__(self, url: str, status: int, headers: CIMultiDict, body: bytes, charset: str = None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.charset = charset
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    def text(self, encoding: str = None):
+        """Returns decoded body
+
+        :param encoding: str - Body encoding (default: charset from headers or utf-8)
+        :return: str - Body text
+        """
+        return self.body.decode(encoding or self.charset or 'utf-8', errors='replace')
+
+
+class HostStats:
+    """Request stats of a single host"""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency = 0.0  # Total seconds
+        self.last_latency = 0.0
+
+    @property
+    def average_latency(self):
+        return self.latency / self.requests if self.requests else 0.0
+
+
+class HttpClient:
+    """Shared non-blocking HTTP client
+
+    Keeps connections alive, limits the number of concurrent requests per host,
+    retries failed requests with exponential backoff and collects latency and traffic stats per host.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self, limit: int = 32, limit_per_host: int = 4, timeout: float = 30, retries: int = 3, backoff: float = 1
+    ):
+        """
+        :param limit: int - Maximum number of open connections
+        :param limit_per_host: int - Maximum number of concurrent requests to the same host
+        :param timeout: float - Total timeout of a single attempt in seconds
+        :param retries: int - Number of additional attempts after a failed one
+        :param backoff: float - Delay before the first retry in seconds (doubled on every next retry)
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = None
+        self.semaphores = {}  # {host: asyncio.Semaphore}
+        self.stats = {}  # {host: HostStats}
+
+    async def get(self, url: str, headers: dict = None):
+        """Sends GET request
+
+        :param url: str - Request URL
+        :param headers: dict - Request headers
+        :return: Response - Response of the last attempt (raises the error if no attempt got a response)
+        """
+        # Session is created lazily inside the running event loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host),
+                timeout=self.timeout
+            )
+
+        host = urlparse(url).hostname
+        stats = self.stats.setdefault(host, HostStats())
+        semaphore = self.semaphores.setdefault(host, asyncio.Semaphore(self.limit_per_host))
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                stats.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        body = await response.read()
+                        result = Response(str(response.url), response.status, CIMultiDict(response.headers), body,
+                                          response.charset)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    stats.errors += 1
+                    if attempt == self.retries:
+                        raise
+                    continue
+                finally:
+                    stats.last_latency = time.perf_counter() - start
+                    stats.latency += stats.last_latency
+                    stats.requests += 1
+
+            stats.bytes += len(result.body)
+            if result.status not in self.RETRY_STATUSES:
+                break
+            stats.errors += 1
+
+        return result
+
+    async def close(self):
+        """Closes all connections"""
+        if self.session is not None:
+            await self.session.close()
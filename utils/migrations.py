@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+
+def migrate(connection, schedule_url: str):
+    """Creates the tables and columns the bot adds to the base schema (runs in a transaction of a pool connection)
+
+    Runs at startup before anything reads the database (guild settings cache, extensions),
+    every statement is idempotent.
+
+    :param connection: psycopg2.extensions.connection - Pool connection
+    :param schedule_url: str - Schedule page of the default schedule source
+    """
+    with connection.cursor() as cursor:
+        # Homework index (filled by message listeners instead of reading channel history)
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS homework ("
+            "message_id BIGINT PRIMARY KEY, "
+            "guild_id BIGINT NOT NULL, "
+            "channel_id BIGINT NOT NULL, "
+            "date DATE NOT NULL, "
+            "content TEXT NOT NULL, "
+            "files TEXT[] NOT NULL, "
+            "source TEXT NOT NULL"
+            ");"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS homework_guild_date_idx ON homework (guild_id, date);")
+
+        # Ledger of distribution messages (replaces searching for posted messages in channel history)
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS distribution_message ("
+            "guild_id BIGINT NOT NULL, "
+            "channel_id BIGINT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "date DATE NOT NULL, "
+            "message_id BIGINT NOT NULL UNIQUE, "
+            "content_hash TEXT NOT NULL, "
+            "PRIMARY KEY (channel_id, kind, date)"
+            ");"
+        )
+
+        # Schedule sources (school websites), guilds are bound to them in ds_guild
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS schedule_source ("
+            "source_name TEXT PRIMARY KEY, "
+            "url TEXT NOT NULL, "
+            "parser TEXT NOT NULL"
+            ");"
+        )
+        cursor.execute(
+            "INSERT INTO schedule_source VALUES ('school36', %s, 'school36') ON CONFLICT DO NOTHING;", (schedule_url, )
+        )
+        cursor.execute(
+            "ALTER TABLE ds_guild ADD COLUMN IF NOT EXISTS "
+            "source_name TEXT NOT NULL DEFAULT 'school36' REFERENCES schedule_source;"
+        )
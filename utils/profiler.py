@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import contextvars
+import random
+import re
+import sys
+import threading
+import time
+
+# Event, command or task loop that has started the current work ('event:on_message', 'command:schedule',
+# 'loop:schedule_distribution'), set by the bot and inherited by the tasks the work creates
+trigger = contextvars.ContextVar('trigger', default=None)
+
+
+def normalize(query: str):
+    """Returns the statement with collapsed whitespace and literals replaced by '?'"""
+    query = re.sub(r"'(?:[^']|'')*'", '?', query)
+    query = re.sub(r'(?<![\w$])\d+\b', '?', query)
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def origin(skip: tuple = ('utils.database', 'utils.profiler', 'asyncio', 'concurrent', 'threading')):
+    """Returns the cog function that has led to the current call ('module:function')
+
+    Walks the stack (which includes the chain of awaiting coroutines) to the first frame of a cog module.
+    Falls back to the first frame outside of the database layer if no cog is involved (e.g. the write queue).
+    This is the innermost cog function, the event or command behind it is the trigger.
+    """
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('cogs.'):
+            return f"{module}:{frame.f_code.co_name}"
+        if fallback is None and not module.startswith(skip):
+            fallback = f"{module}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback or 'unknown'
+
+
+class Timings:
+    """Count, total time and a bounded reservoir of durations for percentiles"""
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        if len(self.samples) < self.size:
+            self.samples.append(duration)
+        else:  # Reservoir sampling keeps a uniform sample of all durations
+            index = random.randrange(self.count)
+            if index < self.size:
+                self.samples[index] = duration
+
+    def percentile(self, fraction: float):
+        """Returns the duration below which the fraction of sampled durations lies"""
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class QueryProfiler:
+    """Timings of database statements by normalized statement and by cog, and the log of slow statements"""
+    def __init__(self, slow_threshold: float = 0.2, reservoir_size: int = 1024, slow_log_size: int = 50):
+        """
+        :param slow_threshold: float - Statements slower than this number of seconds are logged
+        :param reservoir_size: int - Durations kept for percentiles of each statement and cog
+        :param slow_log_size: int - Slow statements kept for the summary
+        """
+        self.slow_threshold = slow_threshold
+        self.reservoir_size = reservoir_size
+        self.statements = {}  # {normalized statement: Timings}
+        self.cogs = {}  # {cog module: Timings}
+        self.slow = deque(maxlen=slow_log_size)  # [(time.time(), seconds, origin, trigger, statement)]
+        self.normalized = {}  # {query: normalized statement}
+        self.lock = threading.Lock()
+
+    def record(self, query: str, duration: float, caller: str, cause: str = None):
+        """Adds the duration of the statement
+
+        :param query: str - Executed statement (with placeholders)
+        :param duration: float - Seconds
+        :param caller: str - 'module:function' that has led to the statement (see origin)
+        :param cause: str - Event, command or task loop that has led to the statement (see trigger)
+        """
+        statement = self.normalized.get(query)
+        if statement is None:
+            statement = self.normalized[query] = normalize(query)
+        cog = caller.split(':')[0]
+        with self.lock:
+            self.statements.setdefault(statement, Timings(self.reservoir_size)).add(duration)
+            self.cogs.setdefault(cog, Timings(self.reservoir_size)).add(duration)
+            if duration >= self.slow_threshold:
+                self.slow.append((time.time(), duration, caller, cause, statement))
+        if duration >= self.slow_threshold:
+            print(f"Slow query ({duration * 1000:.0f} ms) from {caller} ({cause or 'no trigger'}): {statement}")
+
+    def reset(self):
+        """Forgets all timings"""
+        with self.lock:
+            self.statements.clear()
+            self.cogs.clear()
+            self.slow.clear()
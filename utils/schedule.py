@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import io
+import time
+import aiohttp
+import bs4
+from bs4 import BeautifulSoup
+from lxml import etree
+
+
+def parse_schedule(html: str):
+    """Returns all schedules posted on the school website page
+
+    :param html: str - Page content
+    :return: dict - {day: {course: [lesson1, lesson2]}}
+    """
+    soup = BeautifulSoup(html, 'lxml')
+
+    # Get dates
+    dates = [h2.get_text().split()[-2] for h2 in soup.find_all('h2') if "Расписание" in h2.get_text()]
+
+    # Get schedules in HTML format (two tables for each date)
+    tables = [table for table in soup.find_all('tbody') if table.get_text().strip() != '']
+
+    # Get schedules in dict format from tables
+    schedules = {}
+    for pos, day in enumerate(dates):
+        if day in schedules:  # The first schedule of the day is the actual one
+            continue
+        schedule = {}
+        for table in tables[pos*2:pos*2 + 2]:
+            new_table = []
+            for row in table:  # Create table with replaced colspans
+                if isinstance(row, bs4.element.Tag):  # There are NavigableStrings in rows
+                    new_row = []
+                    for col in row:
+                        if isinstance(col, bs4.element.Tag):  # There are NavigableStrings in cols
+                            new_row.append(col.get_text().replace('\n', '').replace('\xa0', ''))
+                            if 'colspan' in col.attrs:  # Replace all cols with colspan
+                                for _ in range(int(col.attrs['colspan']) - 1):
+                                    new_row.append(col.get_text().replace('\n', '').replace('\xa0', ''))
+                    new_table.append(new_row)
+            new_table = [[new_table[j][i] for j in range(len(new_table))] for i in range(len(new_table[0]))]  # rot90
+            for row in new_table[1:]:
+                schedule[row[0]] = [lesson.capitalize() for lesson in row[1:]]
+        schedules[day] = schedule
+
+    return schedules
+
+
+def _text(element):
+    """Returns text of the lxml element and its descendants (same as bs4 get_text, comments are skipped)"""
+    parts = [element.text or '']
+    for child in element:
+        if isinstance(child.tag, str):
+            parts.append(_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def parse_schedule_stream(html: str):
+    """Returns all schedules posted on the school website page
+
+    Gives the same result as parse_schedule, but builds only date headings and tables:
+    the page is read with lxml iterparse, each table is converted to columns in a single pass
+    and every handled element is dropped right away.
+
+    :param html: str - Page content
+    :return: dict - {day: {course: [lesson1, lesson2]}}
+    """
+    dates, tables = [], []
+    events = etree.iterparse(
+        io.BytesIO(html.encode('utf-8')), events=('end', ), tag=('h2', 'tbody'), html=True, encoding='utf-8'
+    )
+    for _, element in events:
+        if element.tag == 'h2':  # Date heading
+            text = _text(element)
+            if "Расписание" in text:
+                dates.append(text.split()[-2])
+        elif _text(element).strip() != '':  # Table (columns with replaced colspans)
+            columns = None
+            for row in element:
+                if not isinstance(row.tag, str):  # There are comments in rows
+                    continue
+                cells = []
+                for col in row:
+                    if isinstance(col.tag, str):
+                        cells += [_text(col).replace('\n', '').replace('\xa0', '')] * max(int(col.get('colspan', 1)), 1)
+                if columns is None:
+                    columns = [[cell] for cell in cells]
+                else:
+                    for column, cell in zip(columns, cells):
+                        column.append(cell)
+            tables.append(columns or [])
+
+        # Free memory of the handled part of the page
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    # Get schedules in dict format from tables (two tables for each date)
+    schedules = {}
+    for pos, day in enumerate(dates):
+        if day in schedules:  # The first schedule of the day is the actual one
+            continue
+        schedules[day] = {
+            column[0]: [lesson.capitalize() for lesson in column[1:]]
+            for columns in tables[pos*2:pos*2 + 2] for column in columns[1:]
+        }
+
+    return schedules
+
+
+class ScheduleCache:
+    """Parsed schedule page
+
+    The page is requested again only when the cached copy is older than max_age.
+    The request is conditional (ETag/Last-Modified), and the page is parsed again only if its content has changed.
+    Concurrent callers share one in-flight request. While the site is down or answers with an error,
+    the cached copy is served.
+    """
+    def __init__(self, url: str, client, max_age: float = 300, parser=parse_schedule_stream):
+        """
+        :param url: str - Schedule page URL
+        :param client: utils.http.HttpClient - Client used for requests
+        :param max_age: float - Seconds during which the cached schedule is used without any request
+        :param parser: function - Page parser (parse_schedule_stream or parse_schedule)
+        """
+        self.url = url
+        self.client = client
+        self.max_age = max_age
+        self.parser = parser
+
+        # Page state
+        self.schedules = None
+        self.etag = None
+        self.last_modified = None
+        self.digest = None
+        self.checked_at = 0.0
+        self.fetching = None  # asyncio.Future of the in-flight request
+
+        # Stats
+        self.requests = 0
+        self.parses = 0
+
+    async def get(self, revalidate: bool = False):
+        """Returns all schedules from the page
+
+        :param revalidate: bool - Check the page even if the cached copy is fresh
+        :return: dict - {day: {course: [lesson1, lesson2]}}
+        """
+        if self.schedules is not None and not revalidate and time.monotonic() - self.checked_at < self.max_age:
+            return self.schedules
+
+        # Join the in-flight request or start the new one
+        if self.fetching is None:
+            self.fetching = asyncio.ensure_future(self.fetch())
+            self.fetching.add_done_callback(lambda _: setattr(self, 'fetching', None))
+        return await asyncio.shield(self.fetching)
+
+    async def fetch(self):
+        """Requests the page and parses it if it has changed
+
+        :return: dict - {day: {course: [lesson1, lesson2]}} (raises RuntimeError if there is no copy to serve)
+        """
+        # Conditional request
+        headers = {}
+        if self.schedules is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        try:
+            response = await self.client.get(self.url, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            response, error_text = None, f"{type(error).__name__} {error}".strip()
+        else:
+            error_text = f"HTTP {response.status}"
+        self.requests += 1
+        self.checked_at = time.monotonic()  # A failed check isn't repeated before max_age either
+
+        # Page hasn't changed
+        if response is not None and response.status == 304:
+            return self.schedules
+
+        # Site is unavailable (error pages are neither parsed nor cached)
+        if response is None or not response.ok:
+            if self.schedules is not None:
+                return self.schedules
+            raise RuntimeError(f"Schedule page is unavailable ({error_text})")
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        digest = hashlib.sha1(response.body).hexdigest()
+        if digest == self.digest:
+            return self.schedules
+
+        # Page has changed
+        self.schedules = self.parser(response.text())
+        self.parses += 1
+        self.digest = digest
+        return self.schedules
+
+
+# Page layouts: {parser name: parser}
+PARSERS = {
+    'school36': parse_schedule_stream,
+}
+
+
+class ScheduleRegistry:
+    """Schedule sources (school websites) by name
+
+    Each source has a single ScheduleCache, so all guilds and commands bound to the source
+    share one request and one parsed page.
+    """
+    def __init__(self, client):
+        """
+        :param client: utils.http.HttpClient - Client used for requests
+        """
+        self.client = client
+        self.sources = {}  # {name: ScheduleCache}
+
+    def register(self, name: str, url: str, parser: str):
+        """Adds a source or replaces the old one with the same name
+
+        :param name: str - Source name
+        :param url: str - Schedule page URL
+        :param parser: str - Page layout name (key of PARSERS)
+        """
+        self.sources[name] = ScheduleCache(url, self.client, parser=PARSERS[parser])
+
+    def __contains__(self, name: str):
+        return name in self.sources
+
+    def __getitem__(self, name: str):
+        return self.sources[name]
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import OrderedDict
+from itertools import count, groupby
+import time
+import traceback
+import psycopg2
+from psycopg2.extras import execute_batch
+from utils.profiler import trigger
+
+
+class WriteBehindQueue:
+    """Write-behind queue of database statements
+
+    Listeners put statements and return at once, a background worker flushes them in one transaction
+    every interval seconds (or as soon as the queue is full). Consecutive statements with the same SQL
+    are sent as one batch. A statement put with a key replaces the pending statement with the same key
+    (e.g. the last rename wins), statements without a key are executed in the order they were put.
+    A statement that fails is dropped alone, the rest of the flush is still written.
+    """
+    def __init__(self, db, max_size: int = 10000, interval: float = 1):
+        """
+        :param db: utils.database.Database - Database to write to
+        :param max_size: int - Maximum number of pending statements (put waits for a flush when the queue is full)
+        :param interval: float - Seconds between flushes
+        """
+        self.db = db
+        self.max_size = max_size
+        self.interval = interval
+
+        self.pending = OrderedDict()  # {key: (query, params)}
+        self.sequence = count()  # Keys of statements without a key
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.lock = asyncio.Lock()
+        self.worker = None
+
+        # Stats
+        self.enqueued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.dropped = 0  # Failed statements skipped in otherwise written flushes
+        self.max_depth = 0
+        self.flush_latency = 0.0  # Total seconds
+        self.last_flush_latency = 0.0
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def start(self):
+        """Starts the background worker"""
+        if self.worker is None:
+            self.worker = asyncio.ensure_future(self.run())
+
+    async def put(self, query: str, params: tuple, key: tuple = None):
+        """Adds a statement to the queue
+
+        :param query: str - SQL statement
+        :param params: tuple - Statement parameters
+        :param key: tuple - Key of the changed value, the pending statement with the same key is replaced
+        """
+        while len(self.pending) >= self.max_size and (key is None or key not in self.pending):
+            self.not_full.clear()
+            self.flush_soon()
+            await self.not_full.wait()
+
+        self.enqueued += 1
+        if key is None:
+            key = ('#', next(self.sequence))
+        elif key in self.pending:
+            self.coalesced += 1
+            self.pending.move_to_end(key)
+        self.pending[key] = (query, params)
+        self.max_depth = max(self.max_depth, len(self.pending))
+
+    def flush_soon(self):
+        """Starts the flush without waiting for the interval"""
+        if not self.lock.locked():
+            asyncio.ensure_future(self.flush())
+
+    async def run(self):
+        """Flushes the queue every interval seconds"""
+        trigger.set('loop:write_queue')
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Writes all pending statements"""
+        async with self.lock:
+            if not self.pending:
+                return
+            batch = list(self.pending.values())
+            self.pending.clear()
+            self.not_full.set()
+
+            start = time.perf_counter()
+            try:
+                await self.db.run(self.write, batch)
+            except Exception as error:
+                self.errors += 1
+                traceback.print_exception(type(error), error, error.__traceback__)
+            else:
+                self.flushed += len(batch)
+            finally:
+                self.flushes += 1
+                self.last_flush_latency = time.perf_counter() - start
+                self.flush_latency += self.last_flush_latency
+
+    @staticmethod
+    def attempt(cursor, function, *args):
+        """Calls function(*args) under a savepoint and rolls its statements back on error
+
+        :return: psycopg2.Error - Error of the function (None on success)
+        """
+        cursor.execute("SAVEPOINT write_queue;")
+        try:
+            function(*args)
+        except psycopg2.Error as error:
+            if cursor.connection.closed:  # Lost connection, the whole flush is retried by the database layer
+                raise
+            cursor.execute("ROLLBACK TO SAVEPOINT write_queue;")
+            return error
+        cursor.execute("RELEASE SAVEPOINT write_queue;")
+        return None
+
+    def write(self, connection, batch):
+        """Executes statements in the transaction of the pool connection (runs in a database thread)
+
+        Each group of statements runs under a savepoint. When the group fails, its statements are executed one by one
+        and only the failing ones are dropped.
+
+        :param connection: psycopg2.extensions.connection - Pool connection
+        :param batch: list of tuples - [(query, params)]
+        """
+        with connection.cursor() as cursor:
+            for query, group in groupby(batch, key=lambda statement: statement[0]):
+                rows = [params for _, params in group]
+                with self.db.measure(query):
+                    error = self.attempt(cursor, execute_batch, cursor, query, rows)
+                if error is None:
+                    continue
+                for params in rows:
+                    with self.db.measure(query):
+                        error = self.attempt(cursor, cursor.execute, query, params)
+                    if error is not None:
+                        self.dropped += 1
+                        print(f"Write queue dropped {query} {params}: {str(error).strip()}")
+
+    async def close(self):
+        """Stops the worker and writes the rest of the queue"""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        await self.flush()